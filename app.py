@@ -10,7 +10,7 @@ from constructs import Construct
 
 app = App()
 
-# Set up the storage stack to create the S3 bucket and notifications
+# Set up the storage stack to create the S3 buckets and notifications
 storage_notification_stack = StorageAndNotificationStack(app, "StorageNotificationStack")
 
 # Create the stack for size tracking, which sets up DynamoDB and the size tracking Lambda
@@ -18,7 +18,18 @@ size_tracker_stack = SizeTrackingLambdaStack(
     app, 
     "SizeTrackerStack", 
     sns_topic=storage_notification_stack.sns_topic, 
-    s3_bucket=storage_notification_stack.s3_bucket
+    s3_buckets=storage_notification_stack.s3_buckets
+)
+
+# Set up the logging Lambda stack, passing in the SNS topic and S3 bucket
+logging_stack = LoggingLambdaStack(
+    app, 
+    "LoggingLambdaStack", 
+    sns_topic=storage_notification_stack.sns_topic, 
+    s3_buckets=storage_notification_stack.s3_buckets,
+    index_table=size_tracker_stack.index_table,
+    aggregate_table=size_tracker_stack.aggregate_table,
+    idempotency_table=size_tracker_stack.idempotency_table
 )
 
 # Set up the plotting Lambda stack, integrating it with DynamoDB and the S3 bucket
@@ -26,7 +37,10 @@ plot_lambda_stack = PlottingLambdaStack(
     app, 
     "PlotLambdaStack",
     dynamodb_table=size_tracker_stack.table,
-    s3_bucket=storage_notification_stack.s3_bucket
+    s3_buckets=storage_notification_stack.s3_buckets,
+    aggregate_table=size_tracker_stack.aggregate_table,
+    prefix_table=size_tracker_stack.prefix_table,
+    archive_bucket=logging_stack.archive_bucket
 )
 
 # Create the API Gateway stack and link it with the plotting Lambda
@@ -45,13 +59,5 @@ driver_stack = DriverLambdaStack(
     plotting_api_id=api_gateway_stack.api_id
 )
 
-# Set up the logging Lambda stack, passing in the SNS topic and S3 bucket
-logging_stack = LoggingLambdaStack(
-    app, 
-    "LoggingLambdaStack", 
-    sns_topic=storage_notification_stack.sns_topic, 
-    s3_bucket=storage_notification_stack.s3_bucket
-)
-
 # Synthesize the CloudFormation template
 app.synth()
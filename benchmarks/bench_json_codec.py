@@ -0,0 +1,71 @@
+import os
+import sys
+import timeit
+
+# The Lambda modules live in lambda/, which is not an importable package name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lambda'))
+
+from bench_s3_events import BATCH_SIZE, raw_delivery_batch, sns_wrapped_batch
+from emf import metric_document
+from json_codec import CODECS, load_codec
+
+REPEAT = 5
+NUMBER = 200
+
+def decode_wrapped(loads, event):
+    # What the handlers do per SNS-wrapped message: the SQS body, then the SNS Message inside it
+    for record in event['Records']:
+        loads(loads(record['body'])['Message'])
+
+def decode_raw(loads, event):
+    for record in event['Records']:
+        loads(record['body'])
+
+def encode_outputs(dumps, documents):
+    # One EMF summary and one archive line per record
+    for document, archive_line in documents:
+        dumps(document)
+        dumps(archive_line)
+
+def output_documents():
+    documents = []
+    for index in range(BATCH_SIZE):
+        document = metric_document(
+            'BucketMetrics',
+            [[], ['BucketName'], ['BucketName', 'Prefix']],
+            {'ObjectSizeChanges': index},
+            {'ObjectSizeChanges': 'Bytes'},
+            {'BucketName': 'benchmark-bucket', 'Prefix': 'prefix/', 'EventCount': 1},
+            storage_resolution=1
+        )
+        archive_line = {
+            'bucket': 'benchmark-bucket',
+            'key': f"prefix/object {index}.txt",
+            'size': index,
+            'event_name': 'ObjectCreated:Put',
+            'sequencer': f"{index:016X}",
+            'event_time': '2024-01-01T00:00:00.000Z',
+            'etag': 'd41d8cd98f00b204e9800998ecf8427e'
+        }
+        documents.append((document, archive_line))
+    return documents
+
+def time_per_record(function):
+    best = min(timeit.repeat(function, repeat=REPEAT, number=NUMBER))
+    return best / (NUMBER * BATCH_SIZE) * 1e6
+
+if __name__ == '__main__':
+    wrapped = sns_wrapped_batch()
+    raw = raw_delivery_batch()
+    documents = output_documents()
+
+    print(f"{'codec':<8} {'SNS-wrapped':>12} {'raw':>12} {'encode':>12}  (us/record)")
+    for name in CODECS:
+        codec_name, loads, dumps = load_codec(name)
+        if codec_name != name:
+            print(f"{name:<8} not installed")
+            continue
+        print(f"{name:<8} "
+              f"{time_per_record(lambda: decode_wrapped(loads, wrapped)):12.2f} "
+              f"{time_per_record(lambda: decode_raw(loads, raw)):12.2f} "
+              f"{time_per_record(lambda: encode_outputs(dumps, documents)):12.2f}")
@@ -0,0 +1,73 @@
+import json
+import os
+import sys
+import timeit
+
+# The Lambda modules live in lambda/, which is not an importable package name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lambda'))
+
+from json_codec import codec_name, loads
+from s3_events import iter_object_events
+
+BATCH_SIZE = 100
+REPEAT = 5
+NUMBER = 200
+
+def notification(index):
+    return {
+        'Records': [{
+            'eventName': 'ObjectCreated:Put',
+            'eventTime': '2024-01-01T00:00:00.000Z',
+            's3': {
+                'bucket': {'name': 'benchmark-bucket'},
+                'object': {
+                    'key': f"prefix/object+{index}.txt",
+                    'size': index,
+                    'eTag': 'd41d8cd98f00b204e9800998ecf8427e',
+                    'sequencer': f"{index:016X}"
+                }
+            }
+        }]
+    }
+
+def sns_wrapped_batch():
+    # Default SNS to SQS delivery: the notification is a JSON string inside the SNS envelope
+    return {'Records': [
+        {
+            'messageId': str(index),
+            'body': json.dumps({'Type': 'Notification', 'MessageId': str(index), 'Message': json.dumps(notification(index))})
+        }
+        for index in range(BATCH_SIZE)
+    ]}
+
+def raw_delivery_batch():
+    return {'Records': [
+        {'messageId': str(index), 'body': json.dumps(notification(index))}
+        for index in range(BATCH_SIZE)
+    ]}
+
+def legacy_decode(event):
+    # The per-handler parsing this replaced: every handler decoded the body and the SNS message itself.
+    # It parses with the same codec as the shared decoder, so only the decoding work is compared
+    sizes = []
+    for record in event['Records']:
+        message = loads(loads(record['body'])['Message'])
+        for s3_record in message['Records']:
+            sizes.append(s3_record['s3']['object'].get('size'))
+    return sizes
+
+def shared_decode(event):
+    return [object_event.size for object_event in iter_object_events(event, set())]
+
+def report(name, function, event):
+    best = min(timeit.repeat(lambda: function(event), repeat=REPEAT, number=NUMBER))
+    per_record = best / (NUMBER * BATCH_SIZE) * 1e6
+    print(f"{name:<28} {per_record:8.2f} us/record")
+
+if __name__ == '__main__':
+    wrapped = sns_wrapped_batch()
+    raw = raw_delivery_batch()
+    print(f"JSON codec: {codec_name}")
+    report('legacy, SNS envelope', legacy_decode, wrapped)
+    report('shared, SNS envelope', shared_decode, wrapped)
+    report('shared, raw delivery', shared_decode, raw)
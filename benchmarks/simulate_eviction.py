@@ -0,0 +1,67 @@
+import argparse
+from datetime import timezone
+import gzip
+import os
+import random
+import sys
+
+# The Lambda modules live in lambda/, which is not an importable package name; it goes last on the
+# path so its logging.py does not shadow the standard library module boto3 imports
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lambda'))
+
+from eviction import POLICIES, simulate
+from json_codec import loads
+from s3_events import parse_event_time
+
+MB = 1024 * 1024
+
+def synthetic_trace(seconds, seed):
+    # A few large build artifacts that are read all the time and rebuilt now and then, next to a
+    # steady stream of small log files that are written once and never read again
+    rng = random.Random(seed)
+    trace = []
+    artifacts = [f"artifacts/build-{index}.tar" for index in range(5)]
+    for artifact in artifacts:
+        trace.append({'time': 0, 'op': 'put', 'key': artifact, 'size': rng.randint(40, 60) * MB})
+
+    for second in range(1, seconds):
+        trace.append({'time': second, 'op': 'put', 'key': f"logs/{second:08d}.log", 'size': rng.randint(50, 400) * 1024})
+        if rng.random() < 0.5:
+            trace.append({'time': second, 'op': 'get', 'key': rng.choice(artifacts), 'size': 0})
+        if rng.random() < 0.002:
+            trace.append({'time': second, 'op': 'put', 'key': rng.choice(artifacts), 'size': rng.randint(40, 60) * MB})
+    return trace
+
+def archive_trace(paths):
+    # Object events in the event archive's NDJSON format, plain or gzip-compressed
+    trace = []
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rb') as archive_file:
+            for line in archive_file:
+                record = loads(line)
+                op = 'put' if record['event_name'].startswith('ObjectCreated') else 'delete'
+                time_seconds = parse_event_time(record['event_time']).replace(tzinfo=timezone.utc).timestamp()
+                trace.append({'time': time_seconds, 'op': op, 'key': record['key'], 'size': record['size'] or 0})
+    trace.sort(key=lambda event: event['time'])
+    return trace
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay an object event trace against every eviction policy.')
+    parser.add_argument('archive_files', nargs='*', help='event archive files to replay instead of a synthetic trace')
+    parser.add_argument('--seconds', type=int, default=6 * 3600, help='length of the synthetic trace')
+    parser.add_argument('--threshold', type=int, default=1024 * MB, help='bucket size that triggers a cleanup')
+    parser.add_argument('--low-watermark', type=int, default=768 * MB, help='size a cleanup evicts down to')
+    parser.add_argument('--reaction-delay', type=float, default=60, help='seconds from crossing to cleanup')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    trace = archive_trace(args.archive_files) if args.archive_files else synthetic_trace(args.seconds, args.seed)
+    options = {'seed': args.seed, 'prefix_quotas': {'logs/': args.low_watermark // 4}}
+
+    print(f"{len(trace)} events, threshold {args.threshold} bytes, low watermark {args.low_watermark} bytes")
+    print(f"{'policy':<18} {'cleanups':>9} {'deletions':>10} {'MB freed':>10} {'misses':>7} {'s over':>8}")
+    for policy in POLICIES:
+        report = simulate(policy, trace, args.threshold, args.low_watermark, args.reaction_delay, options)
+        print(f"{policy:<18} {report['cleanups']:>9} {report['deletions']:>10} "
+              f"{report['bytes_freed'] / MB:>10.1f} {report['misses']:>7} {report['seconds_over_threshold']:>8.0f}")
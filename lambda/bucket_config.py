@@ -0,0 +1,39 @@
+import os
+from functools import lru_cache
+
+from json_codec import loads
+
+# Buckets watched by this deployment, e.g. WATCHED_BUCKETS='["bucket-a", "bucket-b"]';
+# a deployment that only sets BUCKET_NAME watches that single bucket
+watched_buckets = loads(os.getenv('WATCHED_BUCKETS', '[]')) or [
+    bucket for bucket in [os.getenv('BUCKET_NAME')] if bucket
+]
+
+# Per-bucket overrides, e.g. BUCKET_CONFIG='{"bucket-a": {"size_threshold": 1048576}}'
+bucket_overrides = loads(os.getenv('BUCKET_CONFIG', '{}'))
+
+# Settings every bucket starts from; table_partition defaults to the bucket name, and buckets
+# without a low_watermark (in bytes) only lose their largest object in watermark mode.
+# eviction_policy names one of the policies in eviction.py, prefix_quotas maps top-level
+# prefixes to their quota in bytes for the prefix_quota policy
+DEFAULT_CONFIG = {
+    'size_threshold': int(os.getenv('SIZE_THRESHOLD', '15')),
+    'low_watermark': int(os.environ['CLEANUP_LOW_WATERMARK']) if os.getenv('CLEANUP_LOW_WATERMARK') else None,
+    'eviction_policy': os.getenv('CLEANUP_POLICY', 'largest'),
+    'prefix_quotas': {},
+    'table_partition': None
+}
+
+def is_watched(bucket):
+    return not watched_buckets or bucket in watched_buckets
+
+@lru_cache(maxsize=None)
+def bucket_config(bucket):
+    # Merged once per bucket and kept for the lifetime of a warm container
+    config = dict(DEFAULT_CONFIG, table_partition=bucket)
+    config.update(bucket_overrides.get(bucket, {}))
+    return config
+
+def table_partition(bucket):
+    # Partition key value the bucket's items are stored under in the tracking tables
+    return bucket_config(bucket)['table_partition']
@@ -0,0 +1,77 @@
+import boto3
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+
+# Number of prefixes listed in parallel and how many delimiter levels are split before listing
+list_workers = int(os.getenv('LIST_WORKERS', '16'))
+split_depth = int(os.getenv('LIST_SPLIT_DEPTH', '1'))
+list_delimiter = os.getenv('LIST_DELIMITER', '/')
+
+# Size the connection pool so every worker thread gets its own connection
+s3 = boto3.client('s3', config=Config(max_pool_connections=max(list_workers, 10)))
+
+def list_pages(bucket, prefix='', delimiter=None):
+    # Follow continuation tokens until the prefix is exhausted
+    paginator = s3.get_paginator('list_objects_v2')
+    params = {'Bucket': bucket, 'Prefix': prefix}
+    if delimiter:
+        params['Delimiter'] = delimiter
+    return paginator.paginate(**params)
+
+def walk_bucket(bucket, on_page, workers=None, depth=None, delimiter=None, serialized=True):
+    workers = workers or list_workers
+    depth = split_depth if depth is None else depth
+    delimiter = delimiter or list_delimiter
+
+    lock = threading.Lock()
+    stats = {'pages': 0, 'keys': 0, 'prefixes': 0}
+    started = time.monotonic()
+
+    def listed(prefix):
+        with lock:
+            stats['prefixes'] += 1
+
+    def consume(page):
+        contents = page.get('Contents', [])
+        with lock:
+            stats['pages'] += 1
+            stats['keys'] += len(contents)
+            # Callers get one page at a time and never need their own locking
+            if serialized:
+                on_page(contents)
+        # Unserialized callers get pages from every worker thread at once and guard their own state,
+        # so slow work on one page does not hold up the listing of the others
+        if not serialized:
+            on_page(contents)
+
+    def split(prefix):
+        # Objects directly under the prefix are consumed here, deeper ones are returned as child prefixes
+        listed(prefix)
+        children = []
+        for page in list_pages(bucket, prefix, delimiter):
+            consume(page)
+            children.extend(common['Prefix'] for common in page.get('CommonPrefixes', []))
+        return children
+
+    def drain(prefix):
+        listed(prefix)
+        for page in list_pages(bucket, prefix):
+            consume(page)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Break the keyspace into prefixes level by level, then list every prefix in full
+        prefixes = ['']
+        for _ in range(depth):
+            prefixes = [child for children in pool.map(split, prefixes) for child in children]
+            if not prefixes:
+                break
+        list(pool.map(drain, prefixes))
+
+    elapsed = max(time.monotonic() - started, 1e-6)
+    stats['seconds'] = round(elapsed, 3)
+    stats['pages_per_second'] = round(stats['pages'] / elapsed, 1)
+    stats['keys_per_second'] = round(stats['keys'] / elapsed, 1)
+    return stats
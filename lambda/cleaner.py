@@ -1,24 +1,391 @@
 import boto3
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import heapq
+import itertools
 import os
+import time
+import uuid
 
-def lambda_handler(event, context):
-    # Initialize S3 client
-    s3_client = boto3.client('s3')
-    target_bucket = os.getenv('BUCKET_NAME')
-    print(f"Target bucket: {target_bucket}")
+from bucket_config import bucket_config, table_partition, watched_buckets
+from bucket_listing import walk_bucket
+from eviction import select_victims
+from json_codec import loads
+from lease import acquire_lease, lease_enabled, release_lease, renew_lease
+from object_index import index_table, iter_largest_indexed
+from threshold import window_change
+
+# Number of largest objects collected per cleanup run
+top_k = int(os.getenv('CLEANUP_TOP_K', '10'))
+
+# 'largest' deletes the single largest object, 'watermark' deletes objects chosen by the bucket's
+# eviction_policy until the bucket is under its low_watermark, at most CLEANUP_MAX_DELETES per run
+cleanup_mode = os.getenv('CLEANUP_MODE', 'largest')
+max_deletes = int(os.getenv('CLEANUP_MAX_DELETES', '10000'))
+
+# The threshold check and a bucket's ObjectSizeAlarm both invoke the cleaner for the same crossing,
+# the alarm a little later. An alarm run first sums the size changes recorded since this many
+# seconds before the alarm, which covers the alarm's period and its evaluation delay
+alarm_lookback = int(os.getenv('CLEANUP_ALARM_LOOKBACK_SECONDS', '60'))
+
+# Format of the StateChangeTime in alarm notifications, e.g. 2026-01-01T00:00:10.123+0000
+ALARM_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f%z'
+
+# Keys per DeleteObjects call
+DELETE_BATCH_LIMIT = 1000
+
+# HeadObject calls sent in parallel when candidates read from the size index are checked
+verify_workers = int(os.getenv('CLEANUP_VERIFY_WORKERS', '16'))
+
+# Error codes of a HeadObject call on a key that no longer exists
+MISSING_OBJECT_CODES = ('404', 'NoSuchKey', 'NotFound')
+
+# The running totals, read with the size-ordered object index instead of listing the bucket
+dynamodb_resource = boto3.resource('dynamodb')
+aggregate_table = os.getenv('AGGREGATE_TABLE_NAME')
+
+def alarm_time(alarm):
+    # When the alarm went into ALARM, in epoch seconds; the notification's arrival when it does not say
+    try:
+        return datetime.strptime(alarm['StateChangeTime'], ALARM_TIME_FORMAT).timestamp()
+    except (KeyError, ValueError):
+        return time.time()
+
+def target_buckets(event):
+    # Maps each bucket to clean to the time of the alarm that named it, or None for direct invocations
+    buckets = {}
+
+    # Alarm notifications name the bucket in their metric dimensions; an alarm without one says
+    # nothing about which bucket crossed its threshold, so it cleans none
+    for record in event.get('Records', []):
+        alarm = loads(record['Sns']['Message'])
+        dimensions = alarm.get('Trigger', {}).get('Dimensions', [])
+        named = [dimension['value'] for dimension in dimensions if dimension['name'] == 'BucketName']
+        if not named:
+            print(f"Alarm {alarm.get('AlarmName')} does not name a bucket, ignoring it")
+        for bucket in named:
+            buckets[bucket] = alarm_time(alarm)
+
+    # Direct invocations pass the bucket in the payload
+    if 'bucket' in event:
+        buckets[event['bucket']] = None
+
+    # A direct invocation without a named bucket cleans every watched bucket
+    if 'Records' not in event and 'bucket' not in event:
+        return dict.fromkeys(watched_buckets)
+    return buckets
+
+def survey_bucket(bucket, count):
+    # Bounded min-heap of the largest objects seen so far: one pass over every listing page,
+    # holding `count` entries however large the bucket is, and the bucket's totals on the way
+    heap = []
+    totals = {'size': 0, 'objects': 0}
+
+    def add_page(contents):
+        for item in contents:
+            totals['size'] += item['Size']
+            totals['objects'] += 1
+            entry = (item['Size'], item['Key'], item)
+            if len(heap) < count:
+                heapq.heappush(heap, entry)
+            elif entry[:2] > heap[0][:2]:
+                heapq.heapreplace(heap, entry)
+
+    stats = walk_bucket(bucket, add_page)
+    print(f"Scanned {stats['keys']} objects of {bucket} in {stats['pages']} pages in {stats['seconds']}s")
+
+    largest = [
+        {
+            'Key': item['Key'],
+            'Size': item['Size'],
+            'LastModified': item.get('LastModified'),
+            'StorageClass': item.get('StorageClass', 'STANDARD')
+        }
+        for _, _, item in sorted(heap, key=lambda entry: entry[:2], reverse=True)
+    ]
+    return {'largest': largest, 'total_size': totals['size'], 'object_count': totals['objects'], 'list_calls': stats['pages']}
+
+def indexed_candidates(bucket, limit):
+    # Lazily read the largest objects from the size index, or None when the bucket has no
+    # indexed objects or the index cannot be read
+    if not index_table:
+        return None
+    items = iter_largest_indexed(bucket, page_size=min(limit, 1000))
+    try:
+        first = next(items, None)
+    except ClientError as error:
+        print(f"Size index unavailable, listing {bucket} instead: {error!r}")
+        return None
+    if first is None:
+        return None
+
+    candidates = (
+        {
+            'Key': item['Key'],
+            'Size': int(item['Size']),
+            'LastModified': item.get('EventTime'),
+            'StorageClass': item.get('StorageClass', 'STANDARD')
+        }
+        for item in itertools.chain([first], items)
+    )
+    return itertools.islice(candidates, limit)
+
+def indexed_total_size(bucket):
+    if not aggregate_table:
+        return None
+    response = dynamodb_resource.Table(aggregate_table).get_item(Key={'BucketName': table_partition(bucket)})
+    if 'Item' not in response:
+        return None
+    return int(response['Item']['TotalSize'])
+
+def head_size(s3_client, bucket, key):
+    # The object's current size, or None when it no longer exists
+    try:
+        return s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+    except ClientError as error:
+        if error.response.get('Error', {}).get('Code') in MISSING_OBJECT_CODES:
+            return None
+        raise
+
+def verified_candidates(s3_client, bucket, candidates, verification):
+    # The index lags the bucket, so every candidate is checked with a HEAD request before it is
+    # chosen: keys removed since their last event was applied are skipped and the rest count with
+    # the size S3 reports now. verification counts the 'verified' and 'stale' entries
+    with ThreadPoolExecutor(max_workers=verify_workers) as pool:
+        while True:
+            chunk = list(itertools.islice(candidates, verify_workers))
+            if not chunk:
+                return
+            sizes = pool.map(lambda candidate: head_size(s3_client, bucket, candidate['Key']), chunk)
+            for candidate, size in zip(chunk, sizes):
+                if size is None:
+                    verification['stale'] += 1
+                    continue
+                verification['verified'] += 1
+                yield dict(candidate, Size=size)
+
+def index_is_stale(verification):
+    # An index whose entries are mostly gone misses objects as well; those buckets are listed
+    return verification['stale'] > verification['verified']
+
+def largest_candidates(s3_client, bucket, count):
+    # One descending Query answers "largest N" for buckets the index covers; the rest are listed
+    candidates = indexed_candidates(bucket, count)
+    if candidates is not None:
+        verification = {'verified': 0, 'stale': 0}
+        verified = sorted(verified_candidates(s3_client, bucket, candidates, verification),
+                          key=lambda candidate: candidate['Size'], reverse=True)
+        if verified and not index_is_stale(verification):
+            return verified, {'source': 'index', 'list_calls': 0, 'stale_entries': verification['stale']}
+        print(f"{verification['stale']} of the {count} largest indexed objects of {bucket} no longer exist, listing it instead")
+
+    survey = survey_bucket(bucket, count)
+    return survey['largest'], {'source': 'listing', 'list_calls': survey['list_calls']}
+
+def plan_watermark(candidates, total_size, low_watermark):
+    # Removing the largest objects first reaches the watermark with the fewest deletions
+    excess = total_size - low_watermark
+    victims = []
+    for candidate in candidates:
+        if excess <= 0:
+            break
+        victims.append(candidate)
+        excess -= candidate['Size']
+    return victims
+
+def holds_lease(lease):
+    # Renewing the lease before every delete is the fencing check: a run whose lease was taken
+    # over by a newer token stops instead of deleting on top of the new holder
+    if lease is None or renew_lease(*lease):
+        return True
+    print(f"Lease {lease[0]} with token {lease[2]} was taken over, stopping")
+    return False
+
+def delete_keys(s3_client, target_bucket, victims, lease=None):
+    # DeleteObjects removes up to 1000 keys per call; keys it fails on are reported, not retried
+    report = {'deleted': 0, 'bytes_freed': 0, 'delete_calls': 0, 'errors': 0, 'fenced': False}
+    for start in range(0, len(victims), DELETE_BATCH_LIMIT):
+        if not holds_lease(lease):
+            report['fenced'] = True
+            break
+        batch = victims[start:start + DELETE_BATCH_LIMIT]
+        response = s3_client.delete_objects(
+            Bucket=target_bucket,
+            Delete={'Objects': [{'Key': victim['Key']} for victim in batch], 'Quiet': True}
+        )
+        report['delete_calls'] += 1
+
+        failed_keys = {error['Key'] for error in response.get('Errors', [])}
+        for error in response.get('Errors', []):
+            print(f"Failed to delete {error['Key']}: {error.get('Code')} {error.get('Message')}")
+        for victim in batch:
+            if victim['Key'] not in failed_keys:
+                report['deleted'] += 1
+                report['bytes_freed'] += victim['Size']
+        report['errors'] += len(failed_keys)
+    return report
+
+def all_candidates(bucket):
+    # Policies other than largest-first need every object, so this holds the whole bucket in memory
+    candidates = []
+
+    def add_page(contents):
+        for item in contents:
+            candidates.append({
+                'Key': item['Key'],
+                'Size': item['Size'],
+                'LastModified': item['LastModified'].timestamp(),
+                'StorageClass': item.get('StorageClass', 'STANDARD')
+            })
+
+    stats = walk_bucket(bucket, add_page)
+    return candidates, stats['pages']
+
+def clean_with_policy(s3_client, target_bucket, low_watermark, policy, lease=None):
+    candidates, list_calls = all_candidates(target_bucket)
+    total_size = sum(candidate['Size'] for candidate in candidates)
+    options = {'prefix_quotas': bucket_config(target_bucket)['prefix_quotas']}
+    victims = select_victims(policy, candidates, total_size - low_watermark, time.time(), options)[:max_deletes]
+    print(f"{target_bucket} holds {total_size} bytes in {len(candidates)} objects; "
+          f"the {policy} policy removes {len(victims)} objects to reach {low_watermark} bytes")
+
+    report = delete_keys(s3_client, target_bucket, victims, lease)
+    report.update(source='listing', policy=policy, list_calls=list_calls)
+    report['remaining_size'] = total_size - report['bytes_freed']
+    report['watermark_reached'] = report['remaining_size'] <= low_watermark
+    return report
+
+def clean_to_watermark(s3_client, target_bucket, low_watermark, lease=None):
+    # A run that starts after another one already got the bucket under its watermark stops here,
+    # before listing anything
+    total_size = indexed_total_size(target_bucket)
+    if total_size is not None and total_size <= low_watermark:
+        print(f"{target_bucket} already holds only {total_size} bytes, at most {low_watermark}")
+        return {'deleted': 0, 'bytes_freed': 0, 'delete_calls': 0, 'list_calls': 0,
+                'remaining_size': total_size, 'watermark_reached': True}
+
+    policy = bucket_config(target_bucket)['eviction_policy']
+    if policy != 'largest':
+        return clean_with_policy(s3_client, target_bucket, low_watermark, policy, lease)
+
+    # With the running total and the size index, victims are read largest first only until the
+    # excess is covered; otherwise one listing provides both. A stale index that cannot cover the
+    # excess with objects that still exist is replaced by the listing too
+    candidates = indexed_candidates(target_bucket, max_deletes) if total_size is not None else None
+    victims = None
+    if candidates is not None:
+        source, list_calls = 'index', 0
+        verification = {'verified': 0, 'stale': 0}
+        victims = plan_watermark(verified_candidates(s3_client, target_bucket, candidates, verification),
+                                 total_size, low_watermark)
+        covered = total_size - sum(victim['Size'] for victim in victims) <= low_watermark
+        if verification['stale'] and (index_is_stale(verification) or not covered):
+            print(f"{verification['stale']} indexed objects of {target_bucket} no longer exist, listing it instead")
+            victims = None
+    if victims is None:
+        survey = survey_bucket(target_bucket, max_deletes)
+        source, list_calls, total_size = 'listing', survey['list_calls'], survey['total_size']
+        victims = plan_watermark(survey['largest'], total_size, low_watermark)
+    print(f"{target_bucket} holds {total_size} bytes ({'running total' if source == 'index' else 'listing'}); "
+          f"removing {len(victims)} objects to reach {low_watermark} bytes")
+
+    report = delete_keys(s3_client, target_bucket, victims, lease)
+    report.update(source=source, policy=policy, list_calls=list_calls)
+    report['remaining_size'] = total_size - report['bytes_freed']
+    report['watermark_reached'] = report['remaining_size'] <= low_watermark
+    return report
+
+def watermark_mode(target_bucket):
+    return cleanup_mode == 'watermark' and bucket_config(target_bucket)['low_watermark'] is not None
+
+def run_cleanup(s3_client, target_bucket, lease=None):
+    # Watermark mode deletes as many objects as it takes to get under the bucket's low watermark
+    low_watermark = bucket_config(target_bucket)['low_watermark']
+    if watermark_mode(target_bucket):
+        report = clean_to_watermark(s3_client, target_bucket, low_watermark, lease)
+        print(f"Freed {report['bytes_freed']} bytes from {target_bucket} by deleting {report['deleted']} objects "
+              f"in {report['delete_calls']} DeleteObjects calls after {report['list_calls']} list calls")
+        return report
     
-    # Retrieve the list of objects in the specified bucket
-    response = s3_client.list_objects_v2(Bucket=target_bucket)
-    if "Contents" in response:
+    # Find the largest objects across the whole bucket
+    candidates, lookup = largest_candidates(s3_client, target_bucket, top_k)
+    report = {'deleted': 0, 'bytes_freed': 0, 'delete_calls': 0}
+    report.update(lookup)
+    if candidates:
         # Identify the largest file based on its size
-        largest_file = max(response["Contents"], key=lambda obj: obj["Size"])
+        largest_file = candidates[0]
         largest_file_key = largest_file["Key"]
         
-        # Log details of the largest file
+        # Log details of the largest files
+        for candidate in candidates:
+            print(f"Candidate: {candidate['Key']} ({candidate['Size']} bytes, {candidate['StorageClass']}, "
+                  f"last modified {candidate['LastModified']})")
         print(f"Largest file identified: {largest_file_key} ({largest_file['Size']} bytes)")
         
         # Remove the largest file from the bucket
+        if not holds_lease(lease):
+            report['fenced'] = True
+            return report
         s3_client.delete_object(Bucket=target_bucket, Key=largest_file_key)
         print(f"Successfully deleted: {largest_file_key} ({largest_file['Size']} bytes)")
+        report.update(deleted=1, bytes_freed=largest_file['Size'], delete_calls=1)
     else:
         print("The bucket does not contain any files to delete.")
+    return report
+
+def skip_cleanup(target_bucket, reason):
+    # Report what is known about the skipped bucket without listing it
+    total_size = indexed_total_size(target_bucket)
+    report = {'skipped': reason, 'deleted': 0, 'bytes_freed': 0, 'remaining_size': total_size}
+    if watermark_mode(target_bucket) and total_size is not None:
+        report['watermark_reached'] = total_size <= bucket_config(target_bucket)['low_watermark']
+    print(f"Skipping {target_bucket} ({total_size} bytes): {reason}")
+    return report
+
+def crossing_cleaned(target_bucket, raised_at):
+    # The changes since before the alarm include the objects that raised it and the deletions of any
+    # cleanup of the same crossing. Once they sum to less than the threshold, that crossing was
+    # cleaned already; a new crossing in the meantime keeps them over it
+    if not aggregate_table:
+        return False
+    size_change = window_change(target_bucket, raised_at - alarm_lookback, time.time())
+    return size_change < bucket_config(target_bucket)['size_threshold']
+
+def clean_bucket(s3_client, target_bucket, owner=None, raised_at=None):
+    print(f"Target bucket: {target_bucket}")
+    if not lease_enabled():
+        return run_cleanup(s3_client, target_bucket)
+    owner = owner or uuid.uuid4().hex
+
+    # One cleanup per bucket at a time: concurrent alarms and retries must not delete twice
+    lease_id = f"cleanup#{target_bucket}"
+    token = acquire_lease(lease_id, owner)
+    if token is None:
+        return skip_cleanup(target_bucket, 'another cleanup holds the lease')
+
+    lease = (lease_id, owner, token)
+    report = {}
+    try:
+        # Direct invocations always clean; alarms are checked only once the lease is held, so a
+        # cleanup of the same crossing that was still running has finished
+        if raised_at is not None and crossing_cleaned(target_bucket, raised_at):
+            report = skip_cleanup(target_bucket, 'the crossing that raised the alarm was already cleaned')
+        else:
+            report = run_cleanup(s3_client, target_bucket, lease)
+    finally:
+        release_lease(*lease)
+    report['fencing_token'] = token
+    return report
+
+def lambda_handler(event, context):
+    # Initialize S3 client
+    s3_client = boto3.client('s3')
+
+    # The invocation's request id identifies this run as the lease owner
+    owner = getattr(context, 'aws_request_id', None)
+
+    reports = {}
+    for target_bucket, raised_at in target_buckets(event).items():
+        reports[target_bucket] = clean_bucket(s3_client, target_bucket, owner, raised_at)
+    return {'buckets': reports}
@@ -0,0 +1,49 @@
+import boto3
+import os
+import time
+
+# Initialize AWS clients and the retry budget for unprocessed items
+dynamodb_resource = boto3.resource('dynamodb')
+batch_attempts = int(os.getenv('BATCH_WRITE_ATTEMPTS', '5'))
+
+# Request limits of BatchWriteItem and BatchGetItem
+BATCH_WRITE_LIMIT = 25
+BATCH_GET_LIMIT = 100
+
+def backoff(attempt):
+    time.sleep(min(0.05 * 2 ** attempt, 1))
+
+def batch_write(table_name, write_requests):
+    # Send PutRequest/DeleteRequest entries 25 at a time, resending throttled items with backoff
+    for start in range(0, len(write_requests), BATCH_WRITE_LIMIT):
+        request_items = {table_name: write_requests[start:start + BATCH_WRITE_LIMIT]}
+
+        for attempt in range(batch_attempts):
+            response = dynamodb_resource.batch_write_item(RequestItems=request_items)
+            request_items = response.get('UnprocessedItems')
+            if not request_items:
+                break
+            backoff(attempt)
+        else:
+            unprocessed = len(request_items.get(table_name, []))
+            raise RuntimeError(f"{unprocessed} items for {table_name} were still unprocessed after {batch_attempts} attempts")
+
+def batch_get(table_name, keys):
+    items = []
+
+    # Read up to 100 keys per call with strongly consistent reads, retrying unprocessed keys
+    for start in range(0, len(keys), BATCH_GET_LIMIT):
+        request_items = {table_name: {'Keys': keys[start:start + BATCH_GET_LIMIT], 'ConsistentRead': True}}
+
+        for attempt in range(batch_attempts):
+            response = dynamodb_resource.batch_get_item(RequestItems=request_items)
+            items.extend(response['Responses'].get(table_name, []))
+            request_items = response.get('UnprocessedKeys')
+            if not request_items:
+                break
+            backoff(attempt)
+        else:
+            unprocessed = len(request_items.get(table_name, {}).get('Keys', []))
+            raise RuntimeError(f"{unprocessed} keys for {table_name} were still unprocessed after {batch_attempts} attempts")
+
+    return items
@@ -0,0 +1,31 @@
+import time
+
+from json_codec import dumps
+
+def metric_document(namespace, dimension_sets, values, units, properties=None, timestamp=None, storage_resolution=None):
+    # CloudWatch Embedded Metric Format: CloudWatch Logs extracts the metrics listed under _aws
+    # from the document's top-level members, so no metric filter or PutMetricData call is needed.
+    # A storage resolution of 1 stores high-resolution (per-second) data points instead of per-minute ones
+    metrics = []
+    for name in values:
+        metric = {'Name': name, 'Unit': units[name]}
+        if storage_resolution is not None:
+            metric['StorageResolution'] = storage_resolution
+        metrics.append(metric)
+    document = {
+        '_aws': {
+            'Timestamp': int((timestamp or time.time()) * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': dimension_sets,
+                'Metrics': metrics
+            }]
+        }
+    }
+    document.update(properties or {})
+    document.update(values)
+    return document
+
+def emit(document):
+    # A document must be printed as a single log line
+    print(dumps(document))
@@ -0,0 +1,91 @@
+import boto3
+import gzip
+import os
+import time
+import uuid
+
+from json_codec import dumps, loads
+from s3_events import parse_event_time
+
+# Initialize AWS clients and environment variables
+s3 = boto3.client('s3')
+archive_bucket = os.getenv('EVENT_ARCHIVE_BUCKET')
+archive_prefix = os.getenv('EVENT_ARCHIVE_PREFIX', 'events/')
+
+# Uncompressed bytes buffered per partition before a file is rolled, and the gzip level used
+max_file_bytes = int(os.getenv('EVENT_ARCHIVE_MAX_BYTES', str(8 * 1024 * 1024)))
+COMPRESS_LEVEL = 6
+
+# NDJSON lines waiting to be written, per (bucket, hour) partition
+pending_lines = {}
+pending_bytes = {}
+
+def archive_enabled():
+    return bool(archive_bucket)
+
+def event_record(object_event):
+    # The normalized event; the message id is left out since redeliveries carry new ones
+    return {
+        'bucket': object_event.bucket,
+        'key': object_event.key,
+        'size': object_event.size,
+        'event_name': object_event.event_name,
+        'sequencer': object_event.sequencer,
+        'event_time': object_event.event_time,
+        'etag': object_event.etag
+    }
+
+def partition_prefix(bucket, hour):
+    # Hive-style partitions, so query engines can prune by bucket, day and hour
+    return f"{archive_prefix}bucket={bucket}/dt={hour:%Y-%m-%d}/hour={hour:%H}/"
+
+def archive_event(object_event):
+    hour = parse_event_time(object_event.event_time).replace(minute=0, second=0, microsecond=0)
+    partition = (object_event.bucket, hour)
+    line = dumps(event_record(object_event)) + '\n'
+
+    pending_lines.setdefault(partition, []).append(line)
+    pending_bytes[partition] = pending_bytes.get(partition, 0) + len(line)
+
+    # Roll the file as soon as the partition reaches its size limit
+    if pending_bytes[partition] >= max_file_bytes:
+        write_partition(partition)
+
+def write_partition(partition):
+    lines = pending_lines.pop(partition, [])
+    pending_bytes.pop(partition, None)
+    if not lines:
+        return None
+
+    # Millisecond prefix keeps the files of a partition in write order when listed
+    bucket, hour = partition
+    key = f"{partition_prefix(bucket, hour)}{int(time.time() * 1000)}-{uuid.uuid4().hex}.ndjson.gz"
+    s3.put_object(
+        Bucket=archive_bucket,
+        Key=key,
+        Body=gzip.compress(''.join(lines).encode('utf-8'), compresslevel=COMPRESS_LEVEL),
+        ContentType='application/x-ndjson'
+    )
+    return key
+
+def flush_archive():
+    # Write every buffered partition; whatever is left is dropped so a failed batch
+    # is not written again by the next invocation
+    written = []
+    try:
+        for partition in list(pending_lines):
+            written.append(write_partition(partition))
+    finally:
+        pending_lines.clear()
+        pending_bytes.clear()
+    return written
+
+def iter_archive_records(bucket, hour):
+    # Yield the archived events of one bucket and hour, oldest file first
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=archive_bucket, Prefix=partition_prefix(bucket, hour)):
+        for item in page.get('Contents', []):
+            body = s3.get_object(Bucket=archive_bucket, Key=item['Key'])['Body']
+            with gzip.GzipFile(fileobj=body) as compressed:
+                for line in compressed:
+                    yield loads(line)
@@ -0,0 +1,156 @@
+import heapq
+import random
+
+# Eviction policies choose which objects to delete to free `excess` bytes. Each one takes the
+# candidate objects ({'Key', 'Size', 'LastModified', optionally 'LastAccessed'}, times in epoch
+# seconds), the excess, the current time and the policy options, and returns the victims in order
+
+def prefix_of(key):
+    return f"{key.split('/', 1)[0]}/" if '/' in key else '/'
+
+def last_used(candidate):
+    # S3 events carry no reads, so objects without an access time count as used when last written
+    return candidate.get('LastAccessed') or candidate['LastModified']
+
+def take_until(ordered, excess):
+    victims = []
+    for candidate in ordered:
+        if excess <= 0:
+            break
+        victims.append(candidate)
+        excess -= candidate['Size']
+    return victims
+
+def largest_first(candidates, excess, now, options):
+    # Fewest deletions, but the largest objects go first however recently they were used
+    return take_until(sorted(candidates, key=lambda candidate: candidate['Size'], reverse=True), excess)
+
+def oldest_first(candidates, excess, now, options):
+    return take_until(sorted(candidates, key=lambda candidate: candidate['LastModified']), excess)
+
+def lru_approximate(candidates, excess, now, options):
+    # Sampled LRU: evict the least recently used of a few random candidates at a time, which
+    # approaches LRU without ordering the whole bucket
+    sample_size = options.get('sample_size', 5)
+    rng = random.Random(options.get('seed'))
+    remaining = list(candidates)
+    victims = []
+    while excess > 0 and remaining:
+        sample = rng.sample(range(len(remaining)), min(sample_size, len(remaining)))
+        position = min(sample, key=lambda index: last_used(remaining[index]))
+        victim = remaining[position]
+        remaining[position] = remaining[-1]
+        remaining.pop()
+        victims.append(victim)
+        excess -= victim['Size']
+    return victims
+
+def per_prefix_quota(candidates, excess, now, options):
+    # Prefixes over their quota give up their oldest objects first; whatever is still in excess
+    # afterwards is taken oldest first from the whole bucket
+    quotas = options.get('prefix_quotas', {})
+    usage = {}
+    for candidate in candidates:
+        usage[prefix_of(candidate['Key'])] = usage.get(prefix_of(candidate['Key']), 0) + candidate['Size']
+
+    victims = []
+    for candidate in sorted(candidates, key=lambda candidate: candidate['LastModified']):
+        prefix = prefix_of(candidate['Key'])
+        if prefix in quotas and usage[prefix] > quotas[prefix]:
+            victims.append(candidate)
+            usage[prefix] -= candidate['Size']
+            excess -= candidate['Size']
+
+    chosen = {victim['Key'] for victim in victims}
+    remaining = [candidate for candidate in candidates if candidate['Key'] not in chosen]
+    return victims + oldest_first(remaining, excess, now, options)
+
+def size_weighted_age(candidates, excess, now, options):
+    # Large objects that have not been used for a long time score highest
+    def score(candidate):
+        return candidate['Size'] * max(now - last_used(candidate), 0)
+    return take_until(sorted(candidates, key=score, reverse=True), excess)
+
+POLICIES = {
+    'largest': largest_first,
+    'oldest': oldest_first,
+    'lru': lru_approximate,
+    'prefix_quota': per_prefix_quota,
+    'size_weighted_age': size_weighted_age
+}
+
+def select_victims(policy, candidates, excess, now, options=None):
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown eviction policy {policy}, expected one of {', '.join(POLICIES)}")
+    return POLICIES[policy](candidates, excess, now, options or {})
+
+def simulate(policy, trace, threshold, low_watermark, reaction_delay=0, options=None):
+    # Replay a time-ordered trace of {'time', 'op': 'put'|'delete'|'get', 'key', 'size'} events.
+    # Once the bucket grows past the threshold a cleanup runs `reaction_delay` seconds later and
+    # evicts down to the low watermark. Reads of evicted objects are counted as misses
+    objects = {}
+    evicted = set()
+    report = {'policy': policy, 'cleanups': 0, 'deletions': 0, 'bytes_freed': 0, 'misses': 0,
+              'seconds_over_threshold': 0.0}
+    total_size = 0
+    pending_cleanup = []
+    over_since = None
+
+    def run_cleanup(now):
+        nonlocal total_size
+        excess = total_size - low_watermark
+        if excess <= 0:
+            return
+        victims = select_victims(policy, list(objects.values()), excess, now, options)
+        report['cleanups'] += 1
+        for victim in victims:
+            del objects[victim['Key']]
+            evicted.add(victim['Key'])
+            total_size -= victim['Size']
+            report['deletions'] += 1
+            report['bytes_freed'] += victim['Size']
+
+    def track(now):
+        # Account for the time spent above the threshold and schedule a cleanup on crossing it
+        nonlocal over_since
+        if total_size > threshold and over_since is None:
+            over_since = now
+            heapq.heappush(pending_cleanup, now + reaction_delay)
+        elif total_size <= threshold and over_since is not None:
+            report['seconds_over_threshold'] += now - over_since
+            over_since = None
+
+    last_time = 0
+    for event in trace:
+        now = event['time']
+        while pending_cleanup and pending_cleanup[0] <= now:
+            cleanup_time = heapq.heappop(pending_cleanup)
+            run_cleanup(cleanup_time)
+            track(cleanup_time)
+
+        key = event['key']
+        if event['op'] == 'put':
+            previous = objects.get(key)
+            total_size += event['size'] - (previous['Size'] if previous else 0)
+            objects[key] = {'Key': key, 'Size': event['size'], 'LastModified': now, 'LastAccessed': now}
+            evicted.discard(key)
+        elif event['op'] == 'delete' and key in objects:
+            total_size -= objects.pop(key)['Size']
+        elif event['op'] == 'get':
+            if key in objects:
+                objects[key]['LastAccessed'] = now
+            elif key in evicted:
+                report['misses'] += 1
+        track(now)
+        last_time = now
+
+    while pending_cleanup:
+        cleanup_time = heapq.heappop(pending_cleanup)
+        run_cleanup(cleanup_time)
+        track(cleanup_time)
+        last_time = max(last_time, cleanup_time)
+    if over_since is not None:
+        report['seconds_over_threshold'] += last_time - over_since
+
+    report['final_size'] = total_size
+    return report
@@ -0,0 +1,115 @@
+import boto3
+from boto3.dynamodb.conditions import Attr
+from collections import OrderedDict
+import os
+import time
+
+from dynamo_batch import batch_write
+
+# Initialize AWS clients and environment variables
+dynamodb_resource = boto3.resource('dynamodb')
+idempotency_table = os.getenv('IDEMPOTENCY_TABLE_NAME')
+
+# Completed events are remembered as long as SQS can still redeliver them (the default
+# 4-day retention); a claim that is not completed within the function timeout can be taken over
+record_ttl = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', str(4 * 24 * 3600)))
+in_progress_ttl = int(os.getenv('IDEMPOTENCY_IN_PROGRESS_SECONDS', '300'))
+
+# Event ids completed by this container, checked before DynamoDB
+cache_size = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', '10000'))
+completed_cache = OrderedDict()
+
+IN_PROGRESS = 'IN_PROGRESS'
+COMPLETED = 'COMPLETED'
+
+def idempotency_enabled():
+    return bool(idempotency_table)
+
+def event_id(consumer, object_event):
+    # The sequencer identifies an event on a key; events without one fall back to the message id.
+    # Every consumer keeps its own records, since each one must process every event once
+    if object_event.sequencer:
+        return f"{consumer}#{object_event.bucket}#{object_event.key}#{object_event.sequencer.upper()}"
+    return f"{consumer}#{object_event.bucket}#{object_event.key}#m{object_event.message_id}"
+
+def remember(identifier):
+    completed_cache[identifier] = True
+    completed_cache.move_to_end(identifier)
+    if len(completed_cache) > cache_size:
+        completed_cache.popitem(last=False)
+
+def claim(identifier, now):
+    # Authoritative check: the first consumer to write the record owns the event
+    table = dynamodb_resource.Table(idempotency_table)
+    try:
+        response = table.put_item(
+            Item={'EventId': identifier, 'Status': IN_PROGRESS, 'ExpiresAt': int(now) + in_progress_ttl},
+            ConditionExpression=Attr('EventId').not_exists() | (
+                Attr('Status').eq(IN_PROGRESS) & Attr('ExpiresAt').lt(int(now))
+            ),
+            ReturnConsumedCapacity='TOTAL'
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException as error:
+        return False, error.response.get('ConsumedCapacity', {}).get('CapacityUnits', 1.0)
+    return True, response.get('ConsumedCapacity', {}).get('CapacityUnits', 1.0)
+
+def claim_events(consumer, object_events, now=None):
+    # Split events into those this invocation now owns and duplicates to drop
+    if not idempotency_enabled():
+        return list(object_events), None
+
+    now = now or time.time()
+    stats = {'events': len(object_events), 'cache_hits': 0, 'duplicates': 0, 'claims': 0, 'capacity_units': 0.0}
+    claimed = []
+
+    try:
+        for object_event in object_events:
+            identifier = event_id(consumer, object_event)
+            if identifier in completed_cache:
+                completed_cache.move_to_end(identifier)
+                stats['cache_hits'] += 1
+                stats['duplicates'] += 1
+                continue
+
+            owned, capacity_units = claim(identifier, now)
+            stats['claims'] += 1
+            stats['capacity_units'] += capacity_units
+            if owned:
+                claimed.append(object_event)
+            else:
+                stats['duplicates'] += 1
+    except Exception:
+        # Claims taken before the failure would otherwise drop the redelivered events
+        release_events(consumer, claimed)
+        raise
+
+    return claimed, stats
+
+def complete_events(consumer, object_events, now=None):
+    # Mark the events as processed for good, 25 records per BatchWriteItem call
+    if not idempotency_enabled():
+        return
+    expires_at = int(now or time.time()) + record_ttl
+    identifiers = list(dict.fromkeys(event_id(consumer, object_event) for object_event in object_events))
+    batch_write(idempotency_table, [
+        {'PutRequest': {'Item': {'EventId': identifier, 'Status': COMPLETED, 'ExpiresAt': expires_at}}}
+        for identifier in identifiers
+    ])
+    for identifier in identifiers:
+        remember(identifier)
+
+def release_events(consumer, object_events):
+    # Give the events back so their redelivery is processed instead of dropped
+    if not idempotency_enabled():
+        return
+    identifiers = list(dict.fromkeys(event_id(consumer, object_event) for object_event in object_events))
+    batch_write(idempotency_table, [
+        {'DeleteRequest': {'Key': {'EventId': identifier}}} for identifier in identifiers
+    ])
+
+def log_stats(consumer, stats):
+    if stats is None:
+        return
+    print(f"Idempotency ({consumer}): {stats['events']} events, {stats['duplicates']} duplicates "
+          f"({stats['cache_hits']} from cache), {stats['claims']} conditional writes "
+          f"using {stats['capacity_units']:.1f} WCU, {stats['events'] - stats['duplicates']} completion writes")
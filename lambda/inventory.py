@@ -0,0 +1,107 @@
+import boto3
+import csv
+import gzip
+import io
+import os
+from urllib.parse import unquote_plus
+
+from json_codec import loads
+
+# Initialize AWS clients
+s3 = boto3.client('s3')
+
+# Columns read from each inventory row when the manifest lists them
+KEY_FIELD = 'Key'
+SIZE_FIELD = 'Size'
+IS_LATEST_FIELD = 'IsLatest'
+DELETE_MARKER_FIELD = 'IsDeleteMarker'
+
+def split_s3_uri(uri):
+    bucket, _, key = uri[len('s3://'):].partition('/')
+    return bucket, key
+
+def open_location(location):
+    # Inventory files are read from S3 (s3://bucket/key) or from a local path, e.g. test fixtures
+    if location.startswith('s3://'):
+        bucket, key = split_s3_uri(location)
+        return s3.get_object(Bucket=bucket, Key=key)['Body']
+    return open(location, 'rb')
+
+def read_manifest(manifest_location):
+    manifest_file = open_location(manifest_location)
+    try:
+        manifest = loads(manifest_file.read())
+    finally:
+        manifest_file.close()
+
+    if manifest.get('fileFormat') != 'CSV':
+        raise ValueError(f"Unsupported inventory format {manifest.get('fileFormat')}, only CSV can be streamed")
+    return manifest
+
+def destination_root(manifest_location, manifest):
+    # Data file keys are relative to the destination bucket root. Inventory writes the manifest to
+    # <prefix>/<source bucket>/<configuration>/<timestamp>/ and the data files to
+    # <prefix>/<source bucket>/<configuration>/data/, so the root is as many directories above the
+    # timestamp directory as the data keys have segments before data/
+    root = os.path.dirname(os.path.dirname(os.path.abspath(manifest_location)))
+    if not manifest['files']:
+        return root
+    configuration_prefix = manifest['files'][0]['key'].rsplit('/data/', 1)[0]
+    for _ in configuration_prefix.split('/'):
+        root = os.path.dirname(root)
+    return root
+
+def data_file_locations(manifest_location, manifest, data_root=None):
+    # Local manifests resolve the data file keys against data_root, a local copy of the destination
+    # bucket, which defaults to the root the manifest's own location implies
+    if manifest_location.startswith('s3://'):
+        destination_bucket = manifest['destinationBucket'].split(':::')[-1]
+        return [f"s3://{destination_bucket}/{data_file['key']}" for data_file in manifest['files']]
+
+    data_root = data_root or destination_root(manifest_location, manifest)
+    return [os.path.join(data_root, data_file['key']) for data_file in manifest['files']]
+
+def iter_inventory_records(manifest_location, data_root=None, manifest=None):
+    manifest = manifest or read_manifest(manifest_location)
+    columns = [column.strip() for column in manifest['fileSchema'].split(',')]
+    key_index = columns.index(KEY_FIELD)
+    size_index = columns.index(SIZE_FIELD)
+    latest_index = columns.index(IS_LATEST_FIELD) if IS_LATEST_FIELD in columns else None
+    marker_index = columns.index(DELETE_MARKER_FIELD) if DELETE_MARKER_FIELD in columns else None
+
+    for location in data_file_locations(manifest_location, manifest, data_root):
+        # Decompress and parse one row at a time so memory stays bounded by a single row
+        with gzip.GzipFile(fileobj=open_location(location)) as compressed:
+            rows = csv.reader(io.TextIOWrapper(compressed, encoding='utf-8', newline=''))
+            for row in rows:
+                # Versioned inventories also list noncurrent versions and delete markers
+                if latest_index is not None and row[latest_index] != 'true':
+                    continue
+                if marker_index is not None and row[marker_index] == 'true':
+                    continue
+                yield unquote_plus(row[key_index]), int(row[size_index] or 0)
+
+def key_prefix(key, depth):
+    # Up to `depth` leading path segments of the key, '' for objects at the bucket root
+    return ''.join(f"{segment}/" for segment in key.split('/')[:-1][:depth])
+
+def summarize_inventory(manifest_location, prefix_depth=1, data_root=None):
+    total_size = 0
+    object_count = 0
+    prefix_sizes = {}
+
+    manifest = read_manifest(manifest_location)
+    for key, size in iter_inventory_records(manifest_location, data_root, manifest):
+        total_size += size
+        object_count += 1
+        prefix_totals = prefix_sizes.setdefault(key_prefix(key, prefix_depth), {'size': 0, 'count': 0})
+        prefix_totals['size'] += size
+        prefix_totals['count'] += 1
+
+    return {
+        'bucket': manifest['sourceBucket'],
+        'created': int(manifest['creationTimestamp']),
+        'total_size': total_size,
+        'object_count': object_count,
+        'prefix_sizes': prefix_sizes
+    }
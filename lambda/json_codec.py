@@ -0,0 +1,55 @@
+from decimal import Decimal
+import json
+import os
+
+# 'auto' picks the fastest installed parser: orjson, then ujson, then the standard library;
+# a deployment can pin one of them with JSON_CODEC=orjson|ujson|json
+CODEC_PREFERENCE = ('orjson', 'ujson', 'json')
+
+def encode_default(value):
+    # DynamoDB returns numbers as Decimal, which none of the codecs serialize by themselves
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def stdlib_codec():
+    def dumps(value):
+        return json.dumps(value, separators=(',', ':'), default=encode_default)
+    return json.loads, dumps
+
+def orjson_codec():
+    import orjson
+
+    def dumps(value):
+        return orjson.dumps(value, default=encode_default).decode('utf-8')
+    return orjson.loads, dumps
+
+def ujson_codec():
+    import ujson
+
+    def dumps(value):
+        return ujson.dumps(value, ensure_ascii=False, default=encode_default)
+    return ujson.loads, dumps
+
+CODECS = {
+    'json': stdlib_codec,
+    'orjson': orjson_codec,
+    'ujson': ujson_codec
+}
+
+def load_codec(name='auto'):
+    # Returns the codec's name with its loads and dumps; dumps always produces compact str output
+    if name != 'auto' and name not in CODECS:
+        print(f"Unknown JSON codec {name}, expected one of {', '.join(CODECS)}; using json")
+        return ('json',) + stdlib_codec()
+
+    candidates = CODEC_PREFERENCE if name == 'auto' else (name,)
+    for candidate in candidates:
+        try:
+            return (candidate,) + CODECS[candidate]()
+        except ImportError:
+            continue
+    print(f"JSON codec {name} is not installed, using json")
+    return ('json',) + stdlib_codec()
+
+codec_name, loads, dumps = load_codec(os.getenv('JSON_CODEC', 'auto'))
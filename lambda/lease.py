@@ -0,0 +1,63 @@
+import boto3
+from boto3.dynamodb.conditions import Attr
+import os
+import time
+
+# Initialize AWS clients and environment variables
+dynamodb_resource = boto3.resource('dynamodb')
+lease_table = os.getenv('LEASE_TABLE_NAME')
+
+# A lease left behind by a crashed holder can be taken over once it expires
+lease_duration = int(os.getenv('LEASE_SECONDS', '300'))
+
+def lease_enabled():
+    return bool(lease_table)
+
+def acquire_lease(lease_id, owner, now=None):
+    # Take the lease if it is free or expired. Every acquisition increments the fencing token, so
+    # a holder whose lease was taken over can tell from its older token. Lease items are never
+    # deleted, which keeps tokens increasing
+    now = int(now or time.time())
+    table = dynamodb_resource.Table(lease_table)
+    try:
+        response = table.update_item(
+            Key={'LeaseId': lease_id},
+            UpdateExpression='SET #owner = :owner, ExpiresAt = :expires_at ADD FencingToken :one',
+            ConditionExpression=Attr('LeaseId').not_exists() | Attr('ExpiresAt').lt(now),
+            ExpressionAttributeNames={'#owner': 'Owner'},
+            ExpressionAttributeValues={':owner': owner, ':expires_at': now + lease_duration, ':one': 1},
+            ReturnValues='ALL_NEW'
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return None
+    return int(response['Attributes']['FencingToken'])
+
+def renew_lease(lease_id, owner, token, now=None):
+    # Extend the lease only while it is still ours; False means it was taken over and the holder
+    # must stop before doing anything else
+    now = int(now or time.time())
+    table = dynamodb_resource.Table(lease_table)
+    try:
+        table.update_item(
+            Key={'LeaseId': lease_id},
+            UpdateExpression='SET ExpiresAt = :expires_at',
+            ConditionExpression=Attr('Owner').eq(owner) & Attr('FencingToken').eq(token),
+            ExpressionAttributeValues={':expires_at': now + lease_duration}
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+def release_lease(lease_id, owner, token):
+    # Expire the lease right away so the next run does not wait for it to time out
+    table = dynamodb_resource.Table(lease_table)
+    try:
+        table.update_item(
+            Key={'LeaseId': lease_id},
+            UpdateExpression='SET ExpiresAt = :expired',
+            ConditionExpression=Attr('Owner').eq(owner) & Attr('FencingToken').eq(token),
+            ExpressionAttributeValues={':expired': 0}
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
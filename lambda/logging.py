@@ -1,33 +1,148 @@
-import json
-import boto3
 import os
+import random
+
+from bucket_config import is_watched
+from emf import emit, metric_document
+from event_archive import archive_enabled, archive_event, flush_archive
+from idempotency import claim_events, complete_events, log_stats, release_events
+from json_codec import dumps
+from object_index import resolve_deltas
+from s3_events import iter_object_events
+from threshold import evaluate_threshold, threshold_enabled
+
+# The logging Lambda keeps its own view of the object index
+INDEX_CONSUMER = 'logging'
+
+# Size changes are published as ObjectSizeChanges in BucketMetrics, per bucket for its
+# ObjectSizeAlarm, optionally per bucket and top-level prefix, and without dimensions as the
+# total over every bucket
+METRIC_NAMESPACE = 'BucketMetrics'
+METRIC_NAME = 'ObjectSizeChanges'
+aggregate_by_prefix = os.getenv('LOG_PREFIX_AGGREGATION', 'true').lower() == 'true'
+DIMENSION_SETS = [[], ['BucketName'], ['BucketName', 'Prefix']] if aggregate_by_prefix else [[], ['BucketName']]
+
+# The ObjectSizeAlarms evaluate 10-second periods, which only high-resolution metrics have data for
+METRIC_STORAGE_RESOLUTION = 1
+
+# Fraction of per-object lines still logged for debugging; everything else is summarized per batch
+log_sample_rate = float(os.getenv('LOG_SAMPLE_RATE', '0.01'))
+
+# Dimension value used for objects stored at the bucket root
+ROOT_PREFIX = '/'
+
+def top_level_prefix(key):
+    return f"{key.split('/', 1)[0]}/" if '/' in key else ROOT_PREFIX
+
+def summary_key(bucket, key):
+    return (bucket, top_level_prefix(key)) if aggregate_by_prefix else (bucket, None)
+
+def add_to_summary(summaries, summary_key, size_change):
+    # Reduce the batch to a sum, count and min/max size change per bucket (and prefix)
+    summary = summaries.get(summary_key)
+    if summary is None:
+        summaries[summary_key] = {'sum': size_change, 'count': 1, 'min': size_change, 'max': size_change}
+        return
+    summary['sum'] += size_change
+    summary['count'] += 1
+    summary['min'] = min(summary['min'], size_change)
+    summary['max'] = max(summary['max'], size_change)
+
+def summary_documents(summaries):
+    documents = []
+    for (bucket, prefix), summary in summaries.items():
+        properties = {'BucketName': bucket}
+        if prefix is not None:
+            properties['Prefix'] = prefix
+        properties.update(EventCount=summary['count'], MinSizeChange=summary['min'], MaxSizeChange=summary['max'])
+
+        documents.append(metric_document(
+            METRIC_NAMESPACE,
+            DIMENSION_SETS,
+            {METRIC_NAME: summary['sum']},
+            {METRIC_NAME: 'Bytes'},
+            properties,
+            storage_resolution=METRIC_STORAGE_RESOLUTION
+        ))
+    return documents
 
 def lambda_handler(event, context):
-    # Initialize the S3 client
-    s3_client = boto3.client('s3')
-    target_bucket = os.getenv('BUCKET_NAME')
+    failed_message_ids = set()
+    events_by_bucket = {}
+    summaries = {}
+    
+    # Decode every S3 event of the batch, each naming the bucket it came from
+    for object_event in iter_object_events(event, failed_message_ids):
+        if is_watched(object_event.bucket):
+            events_by_bucket.setdefault(object_event.bucket, []).append(object_event)
     
-    for record in event['Records']:
-        # Parse the message body from the event
-        msg_body = json.loads(record['body'])
-        sns_payload = json.loads(msg_body['Message'])
+    # Archive the normalized events before they are applied, so a failed write retries the whole batch
+    if archive_enabled():
+        try:
+            for object_events in events_by_bucket.values():
+                for object_event in object_events:
+                    archive_event(object_event)
+            flush_archive()
+        except Exception as error:
+            print(f"Failed to archive the batch: {error!r}")
+            for object_events in events_by_bucket.values():
+                failed_message_ids.update(object_event.message_id for object_event in object_events)
+            events_by_bucket = {}
+    
+    for source_bucket, object_events in events_by_bucket.items():
+        # Drop redelivered events, then calculate the size changes against the object index with one
+        # batched lookup per bucket, so overwrites only count the difference and removals subtract
+        # the indexed size
+        claimed_events = []
+        failed_keys = set()
+        try:
+            claimed_events, stats = claim_events(INDEX_CONSUMER, object_events)
+            log_stats(INDEX_CONSUMER, stats)
+            deltas = resolve_deltas(source_bucket, claimed_events, INDEX_CONSUMER, failed_keys=failed_keys) if claimed_events else []
+        except Exception as error:
+            print(f"Failed to resolve {len(object_events)} events for {source_bucket}: {error!r}")
+            release_events(INDEX_CONSUMER, claimed_events)
+            failed_message_ids.update(object_event.message_id for object_event in object_events)
+            continue
         
-        # Extract details from the S3 event
-        s3_event_details = sns_payload['Records'][0]
-        source_bucket = s3_event_details['s3']['bucket']['name']
-        object_key = s3_event_details['s3']['object']['key']
-        event_action = s3_event_details['eventName']
+        # Keys whose index entries could not be written send their messages back. Every other
+        # event is counted now, since its entry is stored and its redelivery changes nothing
+        failed_events = [object_event for object_event in claimed_events if object_event.key in failed_keys]
+        failed_message_ids.update(object_event.message_id for object_event in failed_events)
+        try:
+            release_events(INDEX_CONSUMER, failed_events)
+            complete_events(INDEX_CONSUMER, [object_event for object_event in claimed_events if object_event.key not in failed_keys])
+        except Exception as error:
+            print(f"Failed to update the processed state of {len(claimed_events)} events: {error!r}")
         
-        # Calculate the size change based on the event type
-        size_change = 0
-        if event_action.startswith("ObjectCreated"):
-            size_change = s3_event_details['s3']['object'].get('size', 0)  # Default to 0 if size is absent
-        elif event_action.startswith("ObjectRemoved"):
-            size_change = -s3_event_details['s3']['object'].get('size', 0)  # Default to 0 if size is absent
+        for object_event, delta in zip(claimed_events, deltas):
+            if object_event.key in failed_keys:
+                continue
+            size_change = delta[0] if delta else 0  # Events that cannot be resolved count as 0
+            
+            # Log details of a sample of the events
+            if random.random() < log_sample_rate:
+                event_log = {
+                    "file_name": object_event.key,
+                    "size_change": size_change
+                }
+                print(dumps(event_log))
+            
+            add_to_summary(summaries, summary_key(source_bucket, object_event.key), size_change)
         
-        # Log event details
-        event_log = {
-            "file_name": object_key,
-            "size_change": size_change
-        }
-        print(json.dumps(event_log))
+        # Check the bucket's sliding window right away; the CloudWatch alarm still catches
+        # whatever this misses
+        batch_change = sum(delta[0] for delta in deltas if delta)
+        if threshold_enabled() and batch_change:
+            try:
+                evaluate_threshold(source_bucket, batch_change)
+            except Exception as error:
+                print(f"Failed to evaluate the size threshold of {source_bucket}: {error!r}")
+    
+    # Publish the batch once, as one Embedded Metric Format summary per bucket (and prefix)
+    for document in summary_documents(summaries):
+        emit(document)
+    
+    # Partial batch response: only the listed messages are retried
+    return {
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]
+    }
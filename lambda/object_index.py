@@ -0,0 +1,266 @@
+import boto3
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+
+from bucket_config import table_partition
+from dynamo_batch import backoff, batch_get
+
+# Conditional writes sent in parallel when entries are seeded from a listing page
+seed_workers = int(os.getenv('INDEX_SEED_WORKERS', '16'))
+
+# Initialize AWS clients; listings seed pages from every listing thread at once, so the pool
+# holds a connection for each seeding thread of each of them
+list_workers = int(os.getenv('LIST_WORKERS', '16'))
+dynamodb_resource = boto3.resource('dynamodb', config=Config(max_pool_connections=max(seed_workers * list_workers, 10)))
+
+# Table mapping (bucket, object key) to the object's last known size, ETag and sequencer
+index_table = os.getenv('OBJECT_INDEX_TABLE_NAME')
+
+# The size tracker owns the bucket's own partition of the index, other consumers get their own
+PRIMARY_CONSUMER = 'size'
+
+# S3 sequencers are hex strings of varying length, stored left-padded so they compare as strings
+SEQUENCER_WIDTH = 32
+
+# Tombstones of removed keys outlive any redelivery of the events they could be confused with
+TOMBSTONE_TTL = int(os.getenv('INDEX_TOMBSTONE_TTL_SECONDS', str(4 * 24 * 3600)))
+
+# Conditional writes retried when a parallel consumer updates the same key first
+WRITE_ATTEMPTS = 5
+
+# Items per TransactWriteItems call
+TRANSACTION_ITEM_LIMIT = 100
+
+# Sparse global secondary index over the size tracker's live entries. Entries are spread over one
+# partition per bucket and size class (the number of decimal digits of the size, up to 13 for
+# S3's 5 TiB limit) and sorted by Size within it
+SIZE_INDEX = 'BySize'
+MAX_SIZE_CLASS = 13
+
+def index_partition(bucket, consumer):
+    # Each consumer keeps its own view of the index, so one that lags behind the other
+    # still compares against the state it applied last and computes its own exact deltas
+    partition = table_partition(bucket)
+    if consumer == PRIMARY_CONSUMER:
+        return partition
+    return f"{partition}#{consumer}"
+
+def size_class(partition, size):
+    return f"{partition}#{len(str(size)):02d}"
+
+def normalize_sequencer(sequencer):
+    return (sequencer or '').upper().rjust(SEQUENCER_WIDTH, '0')
+
+def load_index_entries(partition, keys):
+    entries = batch_get(index_table, [{'BucketName': partition, 'Key': key} for key in keys])
+    return {entry['Key']: entry for entry in entries}
+
+def tombstone(partition, key, sequencer, now):
+    # Removed keys keep their sequencer for a while, so a create that arrives late is recognized as stale
+    return {
+        'BucketName': partition,
+        'Key': key,
+        'Size': 0,
+        'Deleted': True,
+        'Sequencer': sequencer,
+        'ExpiresAt': int(now) + TOMBSTONE_TTL
+    }
+
+def is_live(entry):
+    return entry is not None and not entry.get('Deleted')
+
+def apply_key_events(partition, entry, key_events, now, size_indexed):
+    # Apply one key's events in sequencer order on top of its indexed entry; events at or below the
+    # entry's sequencer were already applied, or were overtaken by a newer event, and change nothing
+    deltas = {}
+    for position, object_event in key_events:
+        sequencer = normalize_sequencer(object_event.sequencer) if object_event.sequencer else None
+        if sequencer is not None and entry is not None and sequencer <= entry['Sequencer']:
+            deltas[position] = (0, 0)
+            continue
+        sequencer = sequencer or (entry['Sequencer'] if entry else normalize_sequencer(''))
+        previous_size = int(entry['Size']) if is_live(entry) else 0
+
+        if object_event.event_name.startswith("ObjectCreated"):
+            # An overwrite only adds the difference to the previously indexed size
+            new_size = object_event.size or 0
+            deltas[position] = (new_size - previous_size, 0 if is_live(entry) else 1)
+            entry = {
+                'BucketName': partition,
+                'Key': object_event.key,
+                'Size': new_size,
+                'ETag': object_event.etag,
+                'Sequencer': sequencer,
+                'EventTime': object_event.event_time
+            }
+            if size_indexed:
+                entry['SizeClass'] = size_class(partition, new_size)
+        elif object_event.event_name.startswith("ObjectRemoved"):
+            # Removals rarely carry a size; the indexed size is what leaves the bucket. An object
+            # that was never indexed cannot be resolved, one that is already removed changes nothing
+            if is_live(entry):
+                deltas[position] = (-previous_size, -1)
+            else:
+                deltas[position] = (0, 0) if entry is not None else None
+            entry = tombstone(partition, object_event.key, sequencer, now)
+        else:
+            deltas[position] = (0, 0)
+    return entry, deltas
+
+def entry_write(read_entry, entry):
+    # Write only if the key still holds the entry the deltas were computed from, so parallel
+    # consumers never both apply their events on top of the same state. Transaction items take
+    # condition strings, not condition objects
+    write = {'TableName': index_table, 'Item': entry}
+    if read_entry is None:
+        write.update(
+            ConditionExpression='attribute_not_exists(#key)',
+            ExpressionAttributeNames={'#key': 'Key'}
+        )
+    else:
+        write.update(
+            ConditionExpression='#sequencer = :read_sequencer',
+            ExpressionAttributeNames={'#sequencer': 'Sequencer'},
+            ExpressionAttributeValues={':read_sequencer': read_entry['Sequencer']}
+        )
+    return {'Put': write}
+
+def write_entries(writes, written_keys):
+    # Returns None once everything is written, otherwise the keys whose entry changed since it was
+    # read. A lone entry is a plain conditional put, since transactions cost twice the capacity
+    client = dynamodb_resource.meta.client
+    if len(writes) == 1:
+        try:
+            client.put_item(**writes[0]['Put'])
+        except client.exceptions.ConditionalCheckFailedException:
+            return written_keys
+        return None
+
+    try:
+        client.transact_write_items(TransactItems=writes)
+    except client.exceptions.TransactionCanceledException as error:
+        # Reasons follow the order of the writes. Failed entry conditions and transactions that
+        # collided with another write are retried; anything else is an error
+        reasons = [reason.get('Code', 'None') for reason in error.response.get('CancellationReasons', [])]
+        for position, code in enumerate(reasons):
+            if code == 'ConditionalCheckFailed' and position < len(written_keys):
+                continue
+            if code not in ('None', 'TransactionConflict'):
+                raise
+        return [key for key, code in zip(written_keys, reasons) if code == 'ConditionalCheckFailed']
+    return None
+
+def commit_keys(partition, entries, events_by_key, now, size_indexed, delta_writes):
+    # The keys' entries are written in one transaction with the writes that apply their deltas. A
+    # redelivered event whose entry is already stored resolves to no change, which is only right
+    # if the deltas were applied together with the entry
+    for attempt in range(WRITE_ATTEMPTS):
+        writes = []
+        written_keys = []
+        resolved = []
+        for key, key_events in events_by_key.items():
+            new_entry, key_deltas = apply_key_events(partition, entries.get(key), key_events, now, size_indexed)
+            if new_entry is not entries.get(key):
+                writes.append(entry_write(entries.get(key), new_entry))
+                written_keys.append(key)
+            resolved.extend((position, object_event, key_deltas[position]) for position, object_event in key_events)
+        if writes and delta_writes:
+            writes.extend(delta_writes([(object_event, delta) for _, object_event, delta in resolved]))
+
+        conflicts = write_entries(writes, written_keys) if writes else None
+        if conflicts is None:
+            return {position: delta for position, _, delta in resolved}
+
+        # Another consumer updated these keys in between: start over from their state
+        reloaded = load_index_entries(partition, conflicts)
+        for key in conflicts:
+            entries[key] = reloaded.get(key)
+        backoff(attempt)
+    raise RuntimeError(f"Index entries of {partition} kept changing after {WRITE_ATTEMPTS} attempts")
+
+def listed_entry(partition, item):
+    # Entry of an object seen in a listing; the zero sequencer sorts below every event on the key
+    return {
+        'BucketName': partition,
+        'Key': item['Key'],
+        'Size': item['Size'],
+        'ETag': item.get('ETag', '').strip('"'),
+        'Sequencer': normalize_sequencer(''),
+        'EventTime': item['LastModified'].strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+        'SizeClass': size_class(partition, item['Size'])
+    }
+
+def seed_entries(bucket, contents):
+    # Index listed objects no event has reached yet, such as those stored before deployment, so
+    # their first overwrite or removal resolves against their real size. Keys the index already
+    # holds, live or removed, keep their entry. Returns the entries written
+    partition = table_partition(bucket)
+    client = dynamodb_resource.meta.client
+
+    def seed(item):
+        entry = listed_entry(partition, item)
+        try:
+            client.put_item(TableName=index_table, Item=entry, ConditionExpression=Attr('Key').not_exists())
+        except client.exceptions.ConditionalCheckFailedException:
+            return None
+        return entry
+
+    with ThreadPoolExecutor(max_workers=seed_workers) as pool:
+        return [entry for entry in pool.map(seed, contents) if entry is not None]
+
+def resolve_deltas(bucket, object_events, consumer, delta_writes=None, keys_per_transaction=1, failed_keys=None):
+    # delta_writes(resolved) returns the writes that apply the deltas of a group of keys, given as
+    # (object event, delta) pairs; they commit in one transaction with the group's index entries.
+    # A group that cannot be committed is added to failed_keys, leaving its deltas None, or raises
+    # when no set is given. Groups committed before it keep their entries and deltas
+    partition = index_partition(bucket, consumer)
+    now = time.time()
+
+    # S3 notifications can arrive out of order, so each key's events are applied in sequencer order
+    events_by_key = {}
+    for position, object_event in enumerate(object_events):
+        events_by_key.setdefault(object_event.key, []).append((position, object_event))
+    for key_events in events_by_key.values():
+        key_events.sort(key=lambda indexed: normalize_sequencer(indexed[1].sequencer))
+
+    entries = load_index_entries(partition, list(events_by_key))
+
+    # Only the size tracker's entries are indexed by size, tombstones never are
+    size_indexed = consumer == PRIMARY_CONSUMER
+    deltas = [None] * len(object_events)
+    keys = list(events_by_key)
+    for start in range(0, len(keys), keys_per_transaction):
+        group = {key: events_by_key[key] for key in keys[start:start + keys_per_transaction]}
+        try:
+            committed = commit_keys(partition, entries, group, now, size_indexed, delta_writes)
+        except Exception as error:
+            if failed_keys is None:
+                raise
+            print(f"Failed to commit {len(group)} index entries of {partition}: {error!r}")
+            failed_keys.update(group)
+            continue
+        for position, delta in committed.items():
+            deltas[position] = delta
+    return deltas
+
+def iter_largest_indexed(bucket, page_size=100):
+    # Live objects of the bucket, largest first: the size classes are queried from the largest
+    # down, each in descending Size order, one page at a time
+    table = dynamodb_resource.Table(index_table)
+    partition = table_partition(bucket)
+    for size_class_number in range(MAX_SIZE_CLASS, 0, -1):
+        params = {
+            'IndexName': SIZE_INDEX,
+            'KeyConditionExpression': Key('SizeClass').eq(f"{partition}#{size_class_number:02d}"),
+            'ScanIndexForward': False,
+            'Limit': page_size
+        }
+        while True:
+            response = table.query(**params)
+            yield from response['Items']
+            if 'LastEvaluatedKey' not in response:
+                break
+            params['ExclusiveStartKey'] = response['LastEvaluatedKey']
@@ -6,6 +6,11 @@ import time
 import datetime
 import matplotlib.dates as mdates
 
+from bucket_config import is_watched, table_partition
+from json_codec import dumps
+from prefix_tree import top_prefixes
+from size_history import bucket_size_at, parse_time
+
 # Configure MPLCONFIGDIR to use /tmp for Matplotlib in AWS Lambda
 os.environ['MPLCONFIGDIR'] = '/tmp'
 
@@ -13,26 +18,31 @@ os.environ['MPLCONFIGDIR'] = '/tmp'
 dynamodb_resource = boto3.resource('dynamodb')
 s3 = boto3.client('s3')
 dynamodb_table_name = os.getenv('DYNAMODB_TABLE_NAME')
-source_bucket = os.getenv('BUCKET_NAME')
+aggregate_table_name = os.getenv('AGGREGATE_TABLE_NAME')
+default_bucket = os.getenv('BUCKET_NAME')
 plotting_bucket = os.getenv('PLOT_BUCKET_NAME')
 
-def fetch_size_history():
+# Timestamp sort keys are epoch milliseconds followed by a three-digit sequence suffix
+TIMESTAMP_SCALE = 1000000
+
+def fetch_size_history(bucket):
     table = dynamodb_resource.Table(dynamodb_table_name)
     current_time = int(time.time())
     ten_seconds_prior = current_time - 10
     print(type(current_time), type(ten_seconds_prior))
-    print(type(source_bucket))
+    print(type(bucket))
     response = table.query(
-        KeyConditionExpression=boto3.dynamodb.conditions.Key('BucketName').eq(source_bucket) &
-                               boto3.dynamodb.conditions.Key('Timestamp').between(ten_seconds_prior, current_time)
+        KeyConditionExpression=boto3.dynamodb.conditions.Key('BucketName').eq(table_partition(bucket)) &
+                               boto3.dynamodb.conditions.Key('Timestamp').between(
+                                   ten_seconds_prior * TIMESTAMP_SCALE, (current_time + 1) * TIMESTAMP_SCALE - 1)
     )
     return response['Items']
 
-def retrieve_max_size():
+def retrieve_max_size(bucket):
     table = dynamodb_resource.Table(dynamodb_table_name)
     response = table.scan(
         ProjectionExpression='TotalSize',
-        FilterExpression=boto3.dynamodb.conditions.Key('BucketName').eq(source_bucket)
+        FilterExpression=boto3.dynamodb.conditions.Key('BucketName').eq(table_partition(bucket))
     )
     if not response['Items']:
         return 0
@@ -40,8 +50,17 @@ def retrieve_max_size():
     largest_size = max(int(item['TotalSize']) for item in response['Items'])
     return largest_size
 
+def fetch_current_size(bucket):
+    # The size tracker keeps one running-total item per bucket, so this is a single GetItem
+    table = dynamodb_resource.Table(aggregate_table_name)
+    response = table.get_item(Key={'BucketName': table_partition(bucket)})
+    if 'Item' not in response:
+        return 0
+
+    return int(response['Item']['TotalSize'])
+
 def generate_size_plot(size_history, max_bucket_size):
-    timestamps = [datetime.datetime.fromtimestamp(item['Timestamp']) for item in size_history]
+    timestamps = [datetime.datetime.fromtimestamp(int(item['Timestamp']) / TIMESTAMP_SCALE) for item in size_history]
     sizes = [int(item['TotalSize']) for item in size_history]
     
     plt.figure(figsize=(10, 6))
@@ -62,18 +81,51 @@ def generate_size_plot(size_history, max_bucket_size):
     
     return buffer
 
-def upload_plot(buffer):
-    plot_filename = 'plot.png'
+def upload_plot(bucket, buffer):
+    # The default bucket keeps the well-known plot.png name, other buckets get their own file
+    plot_filename = 'plot.png' if bucket == default_bucket else f'plot-{bucket}.png'
     s3.put_object(Bucket=plotting_bucket, Key=plot_filename, Body=buffer, ContentType='image/png')
+    return plot_filename
 
 def lambda_handler(event, context):
-    size_history = fetch_size_history()
-    max_bucket_size = retrieve_max_size()
+    # Plot the bucket named in the request, or the default bucket
+    query = event.get('queryStringParameters') or {}
+    bucket = query.get('bucket', default_bucket)
+    if not is_watched(bucket):
+        return {
+            'statusCode': 400,
+            'body': f"Bucket {bucket} is not tracked by this deployment."
+        }
+
+    # ?top_prefixes=<parent> returns the largest prefixes directly under <parent> instead of a plot
+    if 'top_prefixes' in query:
+        return {
+            'statusCode': 200,
+            'body': dumps(top_prefixes(bucket, query['top_prefixes'], int(query.get('limit', 10))))
+        }
+
+    # ?at=<time> returns the size the bucket had at that time, replayed from the event archive
+    if 'at' in query:
+        try:
+            at = parse_time(query['at'])
+        except ValueError as error:
+            return {'statusCode': 400, 'body': str(error)}
+        size_at = bucket_size_at(bucket, at)
+        if size_at is None:
+            return {
+                'statusCode': 404,
+                'body': f"No snapshot of {bucket} was taken at or before {query['at']}."
+            }
+        return {'statusCode': 200, 'body': dumps(size_at)}
+
+    size_history = fetch_size_history(bucket)
+    max_bucket_size = retrieve_max_size(bucket)
+    current_size = fetch_current_size(bucket)
     
     plot_buffer = generate_size_plot(size_history, max_bucket_size)
-    upload_plot(plot_buffer)
+    plot_filename = upload_plot(bucket, plot_buffer)
     
     return {
         'statusCode': 200,
-        'body': "Plot successfully created and uploaded to S3 as plot.png."
+        'body': f"Plot successfully created and uploaded to S3 as {plot_filename}. Current bucket size: {current_size} bytes."
     }
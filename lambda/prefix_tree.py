@@ -0,0 +1,75 @@
+import boto3
+from boto3.dynamodb.conditions import Key
+from datetime import datetime
+import os
+
+from bucket_config import table_partition
+
+# Initialize AWS clients and environment variables
+dynamodb_resource = boto3.resource('dynamodb')
+prefix_table = os.getenv('PREFIX_TABLE_NAME')
+
+# How many prefix levels below the bucket root are aggregated
+prefix_depth = int(os.getenv('PREFIX_DEPTH', '3'))
+
+# Local secondary index ordering the children of a prefix by TotalSize
+SIZE_INDEX = 'BySize'
+
+def prefix_chain(key, depth):
+    # 'a/b/c.txt' becomes [('', 'a/'), ('a/', 'a/b/')]: each prefix of the key paired with its parent
+    chain = []
+    parent = ''
+    for segment in key.split('/')[:-1][:depth]:
+        prefix = f"{parent}{segment}/"
+        chain.append((parent, prefix))
+        parent = prefix
+    return chain
+
+def accumulate_prefix_deltas(prefix_deltas, key, size_delta, count_delta):
+    # Sum the deltas of a batch per prefix so every prefix is written once per batch
+    for parent, prefix in prefix_chain(key, prefix_depth):
+        totals = prefix_deltas.setdefault((parent, prefix), [0, 0])
+        totals[0] += size_delta
+        totals[1] += count_delta
+
+def parent_partition(bucket, parent):
+    return f"{table_partition(bucket)}#{parent}"
+
+def prefix_writes(bucket, prefix_deltas):
+    # One ADD per changed prefix, in the form TransactWriteItems takes
+    now = int(datetime.utcnow().timestamp())
+    writes = []
+    for (parent, prefix), (size_delta, count_delta) in prefix_deltas.items():
+        if not size_delta and not count_delta:
+            continue
+        writes.append({'Update': {
+            'TableName': prefix_table,
+            'Key': {'ParentPrefix': parent_partition(bucket, parent), 'Prefix': prefix},
+            'UpdateExpression': 'ADD TotalSize :size_delta, ObjectCount :count_delta SET LastUpdated = :now',
+            'ExpressionAttributeValues': {
+                ':size_delta': size_delta,
+                ':count_delta': count_delta,
+                ':now': now
+            }
+        }})
+    return writes
+
+def apply_prefix_deltas(bucket, prefix_deltas):
+    client = dynamodb_resource.meta.client
+    for write in prefix_writes(bucket, prefix_deltas):
+        client.update_item(**write['Update'])
+
+def top_prefixes(bucket, parent='', limit=10):
+    table = dynamodb_resource.Table(prefix_table)
+
+    # The children of a prefix share a partition, so the size index returns the largest ones first
+    response = table.query(
+        IndexName=SIZE_INDEX,
+        KeyConditionExpression=Key('ParentPrefix').eq(parent_partition(bucket, parent)),
+        ScanIndexForward=False,
+        Limit=limit
+    )
+    return [
+        {'prefix': item['Prefix'], 'size': int(item['TotalSize']), 'count': int(item['ObjectCount'])}
+        for item in response['Items']
+    ]
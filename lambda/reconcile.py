@@ -0,0 +1,103 @@
+import boto3
+from datetime import datetime
+import os
+
+from bucket_config import table_partition, watched_buckets
+from size import agreed_drift, aggregate_table, compute_bucket_metrics, flush_metrics, log_metrics_to_dynamodb
+
+# Initialize AWS clients
+dynamodb_resource = boto3.resource('dynamodb')
+cloudwatch = boto3.client('cloudwatch')
+
+# A bucket is listed again after min_interval seconds when its last run found drift;
+# every clean run doubles the wait up to max_interval seconds
+min_interval = int(os.getenv('RECONCILE_MIN_INTERVAL', '900'))
+max_interval = int(os.getenv('RECONCILE_MAX_INTERVAL', '86400'))
+
+def fetch_aggregate(bucket):
+    table = dynamodb_resource.Table(aggregate_table)
+    response = table.get_item(Key={'BucketName': table_partition(bucket)}, ConsistentRead=True)
+    return response.get('Item')
+
+def next_interval(aggregate, size_drift, count_drift, settled):
+    if size_drift or count_drift or not settled:
+        return min_interval
+    return min(int(aggregate.get('ReconcileInterval', min_interval)) * 2, max_interval)
+
+def correct_aggregate(bucket, size_drift, count_drift, interval):
+    table = dynamodb_resource.Table(aggregate_table)
+    now = int(datetime.utcnow().timestamp())
+
+    # The drift is ADDed rather than SET so deltas applied since the total was read survive
+    response = table.update_item(
+        Key={'BucketName': table_partition(bucket)},
+        UpdateExpression='ADD TotalSize :size_drift, ObjectCount :count_drift '
+                         'SET LastUpdated = :now, LastReconciled = :now, LastDrift = :size_drift, '
+                         'ReconcileInterval = :interval, NextReconcileAt = :next_run',
+        ExpressionAttributeValues={
+            ':size_drift': size_drift,
+            ':count_drift': count_drift,
+            ':now': now,
+            ':interval': interval,
+            ':next_run': now + interval
+        },
+        ReturnValues='ALL_NEW'
+    )
+    aggregate = response['Attributes']
+    return int(aggregate['TotalSize']), int(aggregate['ObjectCount'])
+
+def reconcile_bucket(bucket):
+    aggregate = fetch_aggregate(bucket)
+
+    # The size tracker seeds a bucket's running total together with its object index and prefix
+    # sizes on the bucket's first event; a total seeded here would leave the index empty
+    if aggregate is None:
+        print(f"Skipped {bucket}: no running total yet")
+        return None
+
+    # Skip buckets whose adaptive interval has not elapsed yet
+    if int(aggregate.get('NextReconcileAt', 0)) > datetime.utcnow().timestamp():
+        return None
+
+    bucket_size, object_count = compute_bucket_metrics(bucket)
+    listed_aggregate = fetch_aggregate(bucket) or aggregate
+    size_drift = agreed_drift(bucket_size, int(aggregate['TotalSize']), int(listed_aggregate['TotalSize']))
+    count_drift = agreed_drift(object_count, int(aggregate['ObjectCount']), int(listed_aggregate['ObjectCount']))
+
+    # A total that changed during the listing is checked again soon, whatever was corrected
+    settled = listed_aggregate.get('LastUpdated') == aggregate.get('LastUpdated')
+    interval = next_interval(aggregate, size_drift, count_drift, settled)
+
+    total_size, total_objects = correct_aggregate(bucket, size_drift, count_drift, interval)
+    if size_drift or count_drift:
+        log_metrics_to_dynamodb(bucket, total_size, total_objects)
+
+    print(f"Reconciled {bucket}: size drift {size_drift} bytes, object drift {count_drift}, "
+          f"{'settled' if settled else 'updated during the listing'}, next run in {interval}s")
+    return size_drift, count_drift
+
+def publish_drift_metrics(drifts):
+    metric_data = []
+    for bucket, (size_drift, count_drift) in drifts.items():
+        dimensions = [{'Name': 'BucketName', 'Value': bucket}]
+        metric_data.append({'MetricName': 'SizeDrift', 'Dimensions': dimensions, 'Value': size_drift, 'Unit': 'Bytes'})
+        metric_data.append({'MetricName': 'ObjectCountDrift', 'Dimensions': dimensions, 'Value': count_drift, 'Unit': 'Count'})
+
+    if metric_data:
+        cloudwatch.put_metric_data(Namespace='BucketMetrics', MetricData=metric_data)
+
+def lambda_handler(event, context):
+    drifts = {}
+    try:
+        for bucket in watched_buckets:
+            drift = reconcile_bucket(bucket)
+            if drift is not None:
+                drifts[bucket] = drift
+    finally:
+        flush_metrics()
+        publish_drift_metrics(drifts)
+
+    return {
+        'statusCode': 200,
+        'body': f"Reconciled {len(drifts)} of {len(watched_buckets)} buckets."
+    }
@@ -0,0 +1,107 @@
+from collections import namedtuple
+from datetime import datetime
+from urllib.parse import unquote_plus
+
+from json_codec import loads
+
+# One object-level event, whatever envelope it arrived in; size is None when the event carries none
+ObjectEvent = namedtuple(
+    'ObjectEvent',
+    ['message_id', 'bucket', 'key', 'size', 'event_name', 'sequencer', 'event_time', 'etag']
+)
+
+# S3 and EventBridge event times, with and without fractional seconds
+EVENT_TIME_FORMATS = ('%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ')
+
+# EventBridge detail types mapped onto the eventName prefixes of S3 notifications
+EVENTBRIDGE_ACTIONS = {
+    'Object Created': 'ObjectCreated',
+    'Object Deleted': 'ObjectRemoved'
+}
+
+def parse_event_time(event_time):
+    for time_format in EVENT_TIME_FORMATS:
+        try:
+            return datetime.strptime(event_time, time_format)
+        except ValueError:
+            continue
+    # Events without a usable time are filed under the hour they were processed in
+    return datetime.utcnow()
+
+def decode_key(key):
+    # Keys in S3 notifications are URL-encoded; most keys contain nothing to decode
+    if '%' in key or '+' in key:
+        return unquote_plus(key)
+    return key
+
+def from_notification_record(message_id, s3_record):
+    s3_info = s3_record['s3']
+    object_info = s3_info['object']
+    return ObjectEvent(
+        message_id,
+        s3_info['bucket']['name'],
+        decode_key(object_info['key']),
+        object_info.get('size'),
+        s3_record['eventName'],
+        object_info.get('sequencer', ''),
+        s3_record.get('eventTime', ''),
+        object_info.get('eTag', '')
+    )
+
+def from_eventbridge_event(message_id, bridge_event):
+    detail = bridge_event['detail']
+    object_info = detail['object']
+    action = EVENTBRIDGE_ACTIONS.get(bridge_event['detail-type'])
+    if action is None:
+        return None
+
+    return ObjectEvent(
+        message_id,
+        detail['bucket']['name'],
+        object_info['key'],
+        object_info.get('size'),
+        f"{action}:{detail.get('reason', '')}",
+        object_info.get('sequencer', ''),
+        bridge_event.get('time', ''),
+        object_info.get('etag', '')
+    )
+
+def decode_payload(message_id, payload):
+    # A decoded S3 notification, SNS envelope or EventBridge event
+    if 'detail-type' in payload:
+        object_event = from_eventbridge_event(message_id, payload)
+        return [object_event] if object_event else []
+
+    if payload.get('Type') == 'Notification':
+        payload = loads(payload['Message'])
+
+    # s3:TestEvent notifications carry no records
+    return [from_notification_record(message_id, s3_record) for s3_record in payload.get('Records', [])]
+
+def decode_record(record):
+    # Records of SQS, SNS and direct S3 invocations
+    if 'body' in record:
+        return record.get('messageId'), decode_payload(record.get('messageId'), loads(record['body']))
+    if 'Sns' in record:
+        return record['Sns'].get('MessageId'), decode_payload(record['Sns'].get('MessageId'), loads(record['Sns']['Message']))
+    return None, [from_notification_record(None, record)]
+
+def iter_object_events(event, failed_message_ids=None):
+    # Decode lazily, one message at a time, parsing every body exactly once. A message that cannot be
+    # decoded is added to failed_message_ids and skipped, or raises when no set is given
+    if 'detail-type' in event:
+        yield from decode_payload(event.get('id'), event)
+        return
+
+    for record in event.get('Records', []):
+        try:
+            message_id, object_events = decode_record(record)
+        except (AttributeError, KeyError, TypeError, ValueError) as error:
+            if failed_message_ids is None:
+                raise
+            message_id = record.get('messageId') or record.get('Sns', {}).get('MessageId')
+            print(f"Skipping malformed message {message_id}: {error!r}")
+            failed_message_ids.add(message_id)
+            continue
+
+        yield from object_events
@@ -1,51 +1,254 @@
 import boto3
+from boto3.dynamodb.conditions import Attr
 from datetime import datetime
+import itertools
 import os
+import random
+import threading
+import time
+
+from bucket_config import is_watched, table_partition, watched_buckets
+from bucket_listing import walk_bucket
+from dynamo_batch import BATCH_WRITE_LIMIT, batch_write
+from idempotency import claim_events, complete_events, log_stats, release_events
+from object_index import PRIMARY_CONSUMER, TRANSACTION_ITEM_LIMIT, resolve_deltas, seed_entries
+from prefix_tree import accumulate_prefix_deltas, apply_prefix_deltas, prefix_depth, prefix_writes
+from s3_events import iter_object_events
 
 # Initialize AWS clients and environment variables
-s3 = boto3.client('s3')
 dynamodb_resource = boto3.resource('dynamodb')
-source_bucket = os.environ['BUCKET_NAME']
 dynamodb_table = os.environ['DYNAMODB_TABLE_NAME']
+aggregate_table = os.environ['AGGREGATE_TABLE_NAME']
+
+# Keys committed per transaction, leaving room for the aggregate and every prefix of each key
+KEYS_PER_TRANSACTION = (TRANSACTION_ITEM_LIMIT - 1) // (1 + prefix_depth)
+
+# 'incremental' applies the size carried by each S3 event to the last stored total,
+# 'rescan' lists the whole bucket on every invocation
+tracking_mode = os.getenv('SIZE_TRACKING_MODE', 'incremental')
+
+# Data points waiting for the next batch write, and a per-container sequence that starts at a
+# random offset so points written in the same millisecond by different containers rarely collide
+pending_points = []
+timestamp_sequence = itertools.count(random.randrange(1000))
+
+def seed_page(bucket, contents):
+    # Objects indexed for the first time were never counted in the prefix sizes either
+    prefix_deltas = {}
+    for entry in seed_entries(bucket, contents):
+        accumulate_prefix_deltas(prefix_deltas, entry['Key'], entry['Size'], 1)
+    apply_prefix_deltas(bucket, prefix_deltas)
+
+def compute_bucket_metrics(bucket, seed_index=False):
+    totals = {'size': 0, 'objects': 0}
+    lock = threading.Lock()
+
+    def add_page(contents):
+        # Compute the total size and count the objects on each listing page
+        page_size = sum(item['Size'] for item in contents)
+        with lock:
+            totals['size'] += page_size
+            totals['objects'] += len(contents)
+        # Seeding writes every new key, so it runs on the listing threads in parallel
+        if seed_index:
+            seed_page(bucket, contents)
 
-def compute_bucket_metrics():
-    # Fetch the list of objects in the bucket
-    response = s3.list_objects_v2(Bucket=source_bucket)
-    total_bucket_size = 0
-    total_objects = 0
-    
-    if 'Contents' in response:
-        # Compute the total size and count the objects in the bucket
-        for item in response['Contents']:
-            total_bucket_size += item['Size']
-            total_objects += 1
-    
-    return total_bucket_size, total_objects
-
-def log_metrics_to_dynamodb(total_size, object_count):
-    table = dynamodb_resource.Table(dynamodb_table)
-    current_timestamp = int(datetime.utcnow().timestamp())
-    formatted_timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-
-    # Store metrics in DynamoDB
-    table.put_item(
-        Item={
-            'BucketName': source_bucket,
-            'Timestamp': current_timestamp,
-            'TimestampStr': formatted_timestamp,
-            'TotalSize': total_size,
-            'ObjectCount': object_count
+    # List every page of the bucket, split by prefix across worker threads
+    stats = walk_bucket(bucket, add_page, serialized=False)
+    print(f"Listed {stats['keys']} objects of {bucket} in {stats['pages']} pages across {stats['prefixes']} prefixes "
+          f"in {stats['seconds']}s ({stats['pages_per_second']} pages/s, {stats['keys_per_second']} keys/s)")
+
+    return totals['size'], totals['objects']
+
+def aggregate_write(bucket, size_delta, count_delta):
+    # ADD is applied atomically, so parallel consumers never overwrite each other's deltas;
+    # the condition keeps deltas off an aggregate that has not been seeded by a listing yet
+    return {'Update': {
+        'TableName': aggregate_table,
+        'Key': {'BucketName': table_partition(bucket)},
+        'UpdateExpression': 'ADD TotalSize :size_delta, ObjectCount :count_delta SET LastUpdated = :now',
+        'ConditionExpression': 'attribute_exists(BucketName)',
+        'ExpressionAttributeValues': {
+            ':size_delta': size_delta,
+            ':count_delta': count_delta,
+            ':now': int(datetime.utcnow().timestamp())
         }
+    }}
+
+def read_aggregate(bucket):
+    table = dynamodb_resource.Table(aggregate_table)
+    response = table.get_item(Key={'BucketName': table_partition(bucket)}, ConsistentRead=True)
+    if 'Item' not in response:
+        return None
+    return int(response['Item']['TotalSize']), int(response['Item']['ObjectCount'])
+
+def seed_aggregate(bucket, total_size, object_count):
+    # Create the running total from a first listing, unless another consumer created it meanwhile
+    table = dynamodb_resource.Table(aggregate_table)
+    try:
+        table.put_item(
+            Item={
+                'BucketName': table_partition(bucket),
+                'TotalSize': total_size,
+                'ObjectCount': object_count,
+                'LastUpdated': int(datetime.utcnow().timestamp())
+            },
+            ConditionExpression=Attr('BucketName').not_exists()
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+def adjust_aggregate(bucket, size_delta, count_delta):
+    table = dynamodb_resource.Table(aggregate_table)
+    response = table.update_item(
+        Key={'BucketName': table_partition(bucket)},
+        UpdateExpression='ADD TotalSize :size_delta, ObjectCount :count_delta SET LastUpdated = :now',
+        ExpressionAttributeValues={
+            ':size_delta': size_delta,
+            ':count_delta': count_delta,
+            ':now': int(datetime.utcnow().timestamp())
+        },
+        ReturnValues='ALL_NEW'
     )
+    aggregate = response['Attributes']
+    return int(aggregate['TotalSize']), int(aggregate['ObjectCount'])
+
+def agreed_drift(listed, before, after):
+    # Deltas applied while the bucket was being listed may or may not be in the listing, so the
+    # drift lies between the one against the total read before the listing and the one read after.
+    # Only the part both agree on is corrected; the rest is left to the next listing
+    drift_before = listed - before
+    drift_after = listed - after
+    if drift_before * drift_after <= 0:
+        return 0
+    return min(drift_before, drift_after, key=abs)
+
+def rescan_bucket(bucket, seed_index=False):
+    # The listing is applied as an ADD of its difference to the running total, so deltas other
+    # consumers ADD while the bucket is being listed are kept
+    before = read_aggregate(bucket)
+    bucket_size, object_count = compute_bucket_metrics(bucket, seed_index)
+    if before is None and seed_aggregate(bucket, bucket_size, object_count):
+        return bucket_size, object_count
+
+    after = read_aggregate(bucket)
+    before = before or after
+    size_drift = agreed_drift(bucket_size, before[0], after[0])
+    count_drift = agreed_drift(object_count, before[1], after[1])
+    if not size_drift and not count_drift:
+        return after
+    return adjust_aggregate(bucket, size_drift, count_drift)
+
+def group_events_by_bucket(object_events):
+    # Coalesce the batch so every bucket is processed once no matter how many events it has,
+    # skipping buckets this deployment does not watch
+    events_by_bucket = {}
+    for object_event in object_events:
+        if is_watched(object_event.bucket):
+            events_by_bucket.setdefault(object_event.bucket, []).append(object_event)
+    return events_by_bucket
+
+def apply_event_deltas(bucket, object_events):
+    # Deltas go into the running total only once a listing has seeded it
+    seeded = read_aggregate(bucket) is not None
+
+    def delta_writes(resolved):
+        # Roll the resolved deltas up into the sizes of the keys' prefixes and the bucket total
+        prefix_deltas = {}
+        size_delta = 0
+        count_delta = 0
+        for object_event, delta in resolved:
+            if delta is not None:
+                accumulate_prefix_deltas(prefix_deltas, object_event.key, *delta)
+                size_delta += delta[0]
+                count_delta += delta[1]
+        writes = prefix_writes(bucket, prefix_deltas)
+        if seeded and (size_delta or count_delta):
+            writes.append(aggregate_write(bucket, size_delta, count_delta))
+        return writes
+
+    # Resolve exact deltas against the object index, committing each group of index entries together
+    # with its deltas, and fall back to a single full listing when any event cannot be resolved
+    deltas = resolve_deltas(bucket, object_events, PRIMARY_CONSUMER, delta_writes, KEYS_PER_TRANSACTION)
+
+    # The first event for a bucket seeds the aggregate from a listing, which already includes the
+    # batch. Incremental tracking relies on the index, so its listings also index the objects no
+    # event has reached yet
+    totals = read_aggregate(bucket) if seeded and None not in deltas else None
+    if totals is None:
+        return rescan_bucket(bucket, seed_index=True)
+    return totals
+
+def finish_events(object_events):
+    # The deltas are applied; a failure here must not send the messages back for a second count
+    try:
+        complete_events(PRIMARY_CONSUMER, object_events)
+    except Exception as error:
+        print(f"Failed to mark {len(object_events)} events as processed: {error!r}")
+
+def next_timestamp(epoch_seconds):
+    # Epoch milliseconds followed by a three-digit sequence suffix, so data points recorded
+    # within the same second or millisecond get distinct sort keys
+    return int(epoch_seconds * 1000) * 1000 + next(timestamp_sequence) % 1000
+
+def log_metrics_to_dynamodb(bucket, total_size, object_count):
+    now = time.time()
+    formatted_timestamp = datetime.utcfromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+    # Buffer the data point; full batches are written right away, the rest on handler exit
+    pending_points.append({
+        'BucketName': table_partition(bucket),
+        'Timestamp': next_timestamp(now),
+        'TimestampStr': formatted_timestamp,
+        'TotalSize': total_size,
+        'ObjectCount': object_count
+    })
+    if len(pending_points) >= BATCH_WRITE_LIMIT:
+        flush_metrics()
+
+def flush_metrics():
+    # Store buffered metrics in DynamoDB, 25 items per BatchWriteItem call
+    points = pending_points[:]
+    del pending_points[:]
+    batch_write(dynamodb_table, [{'PutRequest': {'Item': point}} for point in points])
 
 def lambda_handler(event, context):
-    # Calculate bucket metrics (size and object count)
-    bucket_size, object_count = compute_bucket_metrics()
+    failed_message_ids = set()
+    events_by_bucket = group_events_by_bucket(iter_object_events(event, failed_message_ids))
 
-    # Log metrics into DynamoDB
-    log_metrics_to_dynamodb(bucket_size, object_count)
+    try:
+        if tracking_mode == 'rescan' or 'Records' not in event:
+            # Calculate bucket metrics (size and object count) from one full listing per bucket;
+            # only invocations without any records, such as scheduled ones, list every watched bucket.
+            # Batches of test events, unwatched buckets or malformed messages list nothing
+            for bucket in events_by_bucket if 'Records' in event else watched_buckets:
+                bucket_size, object_count = rescan_bucket(bucket)
+                log_metrics_to_dynamodb(bucket, bucket_size, object_count)
+        else:
+            # Apply the batch to each bucket's running total, one data point per bucket; a bucket
+            # that fails only sends the messages that carried its records back to the queue
+            for bucket, object_events in events_by_bucket.items():
+                claimed_events = []
+                try:
+                    # Redelivered events were already applied; drop them before they are counted twice
+                    claimed_events, stats = claim_events(PRIMARY_CONSUMER, object_events)
+                    log_stats(PRIMARY_CONSUMER, stats)
+                    if not claimed_events:
+                        continue
+                    bucket_size, object_count = apply_event_deltas(bucket, claimed_events)
+                except Exception as error:
+                    print(f"Failed to apply {len(object_events)} events for {bucket}: {error!r}")
+                    release_events(PRIMARY_CONSUMER, claimed_events)
+                    failed_message_ids.update(object_event.message_id for object_event in object_events)
+                    continue
+                finish_events(claimed_events)
+                log_metrics_to_dynamodb(bucket, bucket_size, object_count)
+    finally:
+        # Never leave buffered data points behind in a frozen container
+        flush_metrics()
 
+    # Partial batch response: only the listed messages are retried
     return {
-        'statusCode': 200,
-        'body': 'Metrics logging Lambda executed successfully.'
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]
     }
@@ -0,0 +1,157 @@
+import calendar
+from datetime import datetime, timedelta
+import gzip
+import os
+import time
+
+from bucket_config import watched_buckets
+from bucket_listing import walk_bucket
+from event_archive import archive_bucket, iter_archive_records, s3
+from json_codec import dumps, loads
+from object_index import normalize_sequencer
+from s3_events import EVENT_TIME_FORMATS, parse_event_time
+
+# Snapshots of the per-object state are stored next to the event archive
+snapshot_prefix = os.getenv('SNAPSHOT_PREFIX', 'snapshots/')
+
+# Events can reach the archive well after they happened, so snapshots stop this far behind
+# the current time to avoid freezing an hour whose events are still arriving
+snapshot_lag = int(os.getenv('SNAPSHOT_LAG_SECONDS', '3600'))
+
+# Snapshot keys carry a zero-padded epoch so they list in time order
+SNAPSHOT_KEY_WIDTH = 12
+
+def epoch_seconds(moment):
+    return calendar.timegm(moment.utctimetuple()) + moment.microsecond / 1e6
+
+def parse_time(value):
+    # Epoch seconds or an ISO 8601 UTC time such as 2024-01-01T12:00:00Z, including the
+    # millisecond times S3 events carry, such as 2024-01-01T12:00:00.123Z
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for time_format in EVENT_TIME_FORMATS + ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%MZ', '%Y-%m-%d'):
+        try:
+            return epoch_seconds(datetime.strptime(value, time_format))
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognized time {value!r}, expected epoch seconds or ISO 8601")
+
+def snapshot_key(bucket, at):
+    return f"{snapshot_prefix}bucket={bucket}/{int(at):0{SNAPSHOT_KEY_WIDTH}d}.json.gz"
+
+def snapshot_times(bucket):
+    paginator = s3.get_paginator('list_objects_v2')
+    times = []
+    for page in paginator.paginate(Bucket=archive_bucket, Prefix=f"{snapshot_prefix}bucket={bucket}/"):
+        for item in page.get('Contents', []):
+            times.append(int(item['Key'].rsplit('/', 1)[-1].split('.', 1)[0]))
+    return times
+
+def load_snapshot(bucket, at):
+    # The latest snapshot taken at or before `at`, or None when there is none
+    times = [snapshot_time for snapshot_time in snapshot_times(bucket) if snapshot_time <= at]
+    if not times:
+        return None
+
+    body = s3.get_object(Bucket=archive_bucket, Key=snapshot_key(bucket, max(times)))['Body']
+    with gzip.GzipFile(fileobj=body) as compressed:
+        return loads(compressed.read())
+
+def store_snapshot(snapshot):
+    s3.put_object(
+        Bucket=archive_bucket,
+        Key=snapshot_key(snapshot['bucket'], snapshot['at']),
+        Body=gzip.compress(dumps(snapshot).encode('utf-8')),
+        ContentType='application/json'
+    )
+
+def archive_hours(start, end):
+    # Every hour partition holding events after `start` up to and including `end`
+    hour = datetime.utcfromtimestamp(start).replace(minute=0, second=0, microsecond=0)
+    last_hour = datetime.utcfromtimestamp(end)
+    while hour <= last_hour:
+        yield hour
+        hour += timedelta(hours=1)
+
+def events_between(bucket, start, end):
+    # Archived events with start < event time <= end, in the order S3 applied them per key
+    events = []
+    for hour in archive_hours(start, end):
+        for record in iter_archive_records(bucket, hour):
+            event_time = epoch_seconds(parse_event_time(record['event_time']))
+            if start < event_time <= end:
+                events.append((event_time, normalize_sequencer(record['sequencer']), record))
+    events.sort(key=lambda event: event[:2])
+    return [record for _, _, record in events]
+
+def replay(objects, records):
+    # Creates set the object's size and removals drop it, so a redelivered event that was
+    # archived twice is applied twice without changing the result
+    for record in records:
+        if record['event_name'].startswith('ObjectCreated'):
+            objects[record['key']] = record['size'] or 0
+        elif record['event_name'].startswith('ObjectRemoved'):
+            objects.pop(record['key'], None)
+    return objects
+
+def listing_snapshot(bucket):
+    # Without a snapshot the replay starts from a listing of the bucket as it is now
+    at = time.time()
+    objects = {}
+
+    def add_page(contents):
+        for item in contents:
+            objects[item['Key']] = item['Size']
+
+    walk_bucket(bucket, add_page)
+    return {'bucket': bucket, 'at': int(at), 'objects': objects}
+
+def rebuild_state(bucket, at):
+    snapshot = load_snapshot(bucket, at)
+    if snapshot is None:
+        return None, 0
+
+    records = events_between(bucket, snapshot['at'], at)
+    objects = replay(snapshot['objects'], records)
+    return {'bucket': bucket, 'at': at, 'snapshot_at': snapshot['at'], 'objects': objects}, len(records)
+
+def bucket_size_at(bucket, at):
+    # Bucket size and object count at `at` (epoch seconds), replayed from the nearest earlier snapshot
+    state, events_replayed = rebuild_state(bucket, at)
+    if state is None:
+        return None
+
+    return {
+        'bucket': bucket,
+        'at': at,
+        'total_size': sum(state['objects'].values()),
+        'object_count': len(state['objects']),
+        'snapshot_at': state['snapshot_at'],
+        'events_replayed': events_replayed
+    }
+
+def take_snapshot(bucket, now=None):
+    # Roll the latest snapshot forward to the last settled hour boundary
+    settled = (now or time.time()) - snapshot_lag
+    at = int(settled // 3600 * 3600)
+
+    times = snapshot_times(bucket)
+    if not times:
+        snapshot = listing_snapshot(bucket)
+        print(f"Seeded the first snapshot of {bucket} from a listing of {len(snapshot['objects'])} objects")
+    elif max(times) >= at:
+        return None
+    else:
+        state, events_replayed = rebuild_state(bucket, at)
+        snapshot = {'bucket': bucket, 'at': at, 'objects': state['objects']}
+        print(f"Rolled the snapshot of {bucket} forward to {at} over {events_replayed} events")
+
+    store_snapshot(snapshot)
+    return snapshot['at']
+
+def lambda_handler(event, context):
+    # Scheduled: snapshot every watched bucket, so replays only cover the events since the last one
+    snapshots = {bucket: take_snapshot(bucket) for bucket in watched_buckets}
+    return {'snapshots': snapshots}
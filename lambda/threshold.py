@@ -0,0 +1,90 @@
+import boto3
+from boto3.dynamodb.conditions import Attr
+import os
+import time
+
+from bucket_config import bucket_config, table_partition
+from dynamo_batch import batch_get
+from json_codec import dumps
+
+# Initialize AWS clients and environment variables
+dynamodb_resource = boto3.resource('dynamodb')
+lambda_client = boto3.client('lambda')
+aggregate_table = os.getenv('AGGREGATE_TABLE_NAME')
+cleaner_function = os.getenv('CLEANER_FUNCTION_NAME')
+
+# The window mirrors ObjectSizeAlarm: the sum of size changes over the last 10 seconds,
+# kept as one item per 1-second slot in the aggregate table
+window_seconds = int(os.getenv('THRESHOLD_WINDOW_SECONDS', '10'))
+SLOT_SECONDS = 1
+
+# Slot items outlive the window briefly and are then removed by the table's TTL
+SLOT_RETENTION = 3600
+
+def threshold_enabled():
+    return bool(aggregate_table and cleaner_function)
+
+def slot_key(bucket, slot):
+    return {'BucketName': f"{table_partition(bucket)}#w{slot}"}
+
+def add_to_window(bucket, size_delta, now):
+    # Add the batch to the current slot and sum the slots still inside the window
+    table = dynamodb_resource.Table(aggregate_table)
+    slot = int(now // SLOT_SECONDS)
+    response = table.update_item(
+        Key=slot_key(bucket, slot),
+        UpdateExpression='ADD SizeChange :size_delta SET ExpiresAt = :expires_at',
+        ExpressionAttributeValues={
+            ':size_delta': size_delta,
+            ':expires_at': int(now) + SLOT_RETENTION
+        },
+        ReturnValues='UPDATED_NEW'
+    )
+
+    first_slot = slot - window_seconds // SLOT_SECONDS + 1
+    earlier_slots = batch_get(aggregate_table, [slot_key(bucket, earlier) for earlier in range(first_slot, slot)])
+    return int(response['Attributes']['SizeChange']) + sum(int(item['SizeChange']) for item in earlier_slots)
+
+def window_change(bucket, start, end):
+    # Net size change recorded in the slots from start up to and including end, in epoch seconds
+    slots = range(int(start // SLOT_SECONDS), int(end // SLOT_SECONDS) + 1)
+    items = batch_get(aggregate_table, [slot_key(bucket, slot) for slot in slots])
+    return sum(int(item['SizeChange']) for item in items)
+
+def claim_cleanup(bucket, now):
+    # Only one consumer invokes the cleaner per window, however many batches cross the threshold
+    table = dynamodb_resource.Table(aggregate_table)
+    try:
+        table.put_item(
+            Item={
+                'BucketName': f"{table_partition(bucket)}#cleanup",
+                'InvokedAt': int(now),
+                'ExpiresAt': int(now) + SLOT_RETENTION
+            },
+            ConditionExpression=Attr('BucketName').not_exists() | Attr('InvokedAt').lte(int(now) - window_seconds)
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+def invoke_cleaner(bucket, window_sum):
+    # Asynchronous invoke: the batch is not held up by the cleanup
+    lambda_client.invoke(
+        FunctionName=cleaner_function,
+        InvocationType='Event',
+        Payload=dumps({'bucket': bucket, 'source': 'threshold', 'window_sum': window_sum})
+    )
+
+def evaluate_threshold(bucket, size_delta, now=None):
+    now = now or time.time()
+    window_sum = add_to_window(bucket, size_delta, now)
+    threshold = bucket_config(bucket)['size_threshold']
+    # Same comparison as ObjectSizeAlarm, which fires at or above its threshold; a shrinking
+    # batch is counted in the window but cannot push it over
+    if size_delta <= 0 or window_sum < threshold or not claim_cleanup(bucket, now):
+        return False
+
+    print(f"Size changes of {bucket} summed to {window_sum} bytes over {window_seconds}s, "
+          f"reaching {threshold}; invoking the cleaner")
+    invoke_cleaner(bucket, window_sum)
+    return True
@@ -1,3 +1,4 @@
+from typing import Sequence
 from aws_cdk import (
     Stack,
     Duration,
@@ -8,19 +9,50 @@ from aws_cdk import (
 )
 import aws_cdk.aws_cloudwatch_actions as cloudwatch_actions
 from aws_cdk.aws_lambda_event_sources import SqsEventSource
-from aws_cdk.aws_sqs import Queue
+from aws_cdk.aws_sqs import Queue, DeadLetterQueue
 from aws_cdk.aws_sns import Topic
 from aws_cdk.aws_sns_subscriptions import SqsSubscription, LambdaSubscription
-from aws_cdk.aws_s3 import Bucket
+from aws_cdk.aws_s3 import Bucket, IBucket, LifecycleRule, StorageClass, Transition
+from aws_cdk.aws_dynamodb import Table, Attribute, AttributeType, BillingMode
+from aws_cdk.aws_events import Rule, Schedule
+from aws_cdk.aws_events_targets import LambdaFunction
 from constructs import Construct
 
 class LogHandlerStack(Stack):
-    def __init__(self, scope: Construct, stack_id: str, sns_topic: Topic, bucket: Bucket, **kwargs):
+    def __init__(self, scope: Construct, stack_id: str, sns_topic: Topic, buckets: Sequence[IBucket], index_table: Table, aggregate_table: Table, idempotency_table: Table, **kwargs):
         super().__init__(scope, stack_id, **kwargs)
 
+        # Every watched bucket is named in the Lambda environment, the first one is the default
+        watched_bucket_names = self.to_json_string([bucket.bucket_name for bucket in buckets])
+
+        # Total object size changes, in bytes, within one window that trigger a cleanup; the logging
+        # Lambda and every bucket's alarm use the same threshold
+        size_threshold = 15
+
         # Create an SQS queue and subscribe it to the provided SNS topic
-        event_queue = Queue(self, "BucketEventQueue", visibility_timeout=Duration.seconds(300))
-        sns_topic.add_subscription(SqsSubscription(event_queue))
+        # Messages that keep failing are moved to a dead-letter queue instead of being retried forever
+        event_queue = Queue(
+            self, "BucketEventQueue",
+            visibility_timeout=Duration.seconds(300),
+            dead_letter_queue=DeadLetterQueue(
+                max_receive_count=5,
+                queue=Queue(self, "BucketEventDeadLetterQueue", retention_period=Duration.days(14))
+            )
+        )
+        # Raw delivery puts the S3 notification itself in the message body, saving a JSON decode per message
+        sns_topic.add_subscription(SqsSubscription(event_queue, raw_message_delivery=True))
+
+        # Create a bucket for the compressed event archive; old partitions move to cheaper storage
+        archive_bucket = Bucket(
+            self, "EventArchiveBucket",
+            lifecycle_rules=[LifecycleRule(
+                prefix='events/',
+                transitions=[Transition(
+                    storage_class=StorageClass.INFREQUENT_ACCESS,
+                    transition_after=Duration.days(30)
+                )]
+            )]
+        )
 
         # Create a Lambda function for handling logging
         logging_function = lambda_.Function(
@@ -30,29 +62,77 @@ class LogHandlerStack(Stack):
             code=lambda_.Code.from_asset("lambda"),
             timeout=Duration.seconds(60),
             environment={
-                'BUCKET_NAME': bucket.bucket_name
+                'BUCKET_NAME': buckets[0].bucket_name,
+                'WATCHED_BUCKETS': watched_bucket_names,
+                'OBJECT_INDEX_TABLE_NAME': index_table.table_name,
+                'AGGREGATE_TABLE_NAME': aggregate_table.table_name,
+                'IDEMPOTENCY_TABLE_NAME': idempotency_table.table_name,
+                'IDEMPOTENCY_IN_PROGRESS_SECONDS': '60',
+                'SIZE_THRESHOLD': str(size_threshold),
+                'THRESHOLD_WINDOW_SECONDS': '10',
+                'LOG_SAMPLE_RATE': '0.01',
+                'LOG_PREFIX_AGGREGATION': 'true',
+                'EVENT_ARCHIVE_BUCKET': archive_bucket.bucket_name,
+                'EVENT_ARCHIVE_PREFIX': 'events/'
             }
         )
-        bucket.grant_read_write(logging_function)
+        for bucket in buckets:
+            bucket.grant_read_write(logging_function)
+        index_table.grant_read_write_data(logging_function)
+        aggregate_table.grant_read_write_data(logging_function)
+        idempotency_table.grant_read_write_data(logging_function)
+        archive_bucket.grant_read_write(logging_function)
 
-        # Configure the logging Lambda to process events from the SQS queue
-        logging_function.add_event_source(SqsEventSource(event_queue))
+        # Configure the logging Lambda to process events from the SQS queue, retrying only failed messages;
+        # larger batches write fewer, larger archive files
+        logging_function.add_event_source(SqsEventSource(
+            event_queue,
+            batch_size=100,
+            max_batching_window=Duration.seconds(5),
+            report_batch_item_failures=True
+        ))
 
-        # Create a Log Group for the Logging Lambda
+        # Create a Lambda function that periodically snapshots the per-object state of every bucket,
+        # so point-in-time queries only replay the archived events since the nearest snapshot
+        snapshot_function = lambda_.Function(
+            self, "SizeSnapshotFunction",
+            runtime=lambda_.Runtime.PYTHON_3_8,
+            handler="size_history.lambda_handler",
+            code=lambda_.Code.from_asset("lambda"),
+            timeout=Duration.minutes(15),
+            memory_size=1024,
+            environment={
+                'BUCKET_NAME': buckets[0].bucket_name,
+                'WATCHED_BUCKETS': watched_bucket_names,
+                'EVENT_ARCHIVE_BUCKET': archive_bucket.bucket_name,
+                'SNAPSHOT_PREFIX': 'snapshots/',
+                'SNAPSHOT_LAG_SECONDS': '3600',
+                'LIST_WORKERS': '16',
+                'LIST_SPLIT_DEPTH': '1'
+            }
+        )
+        Rule(
+            self, "SizeSnapshotSchedule",
+            schedule=Schedule.rate(Duration.hours(6)),
+            targets=[LambdaFunction(snapshot_function)]
+        )
+        archive_bucket.grant_read_write(snapshot_function)
+        for bucket in buckets:
+            bucket.grant_read(snapshot_function)
+
+        # Create a Log Group for the Logging Lambda; the ObjectSizeChanges metric is extracted from the
+        # Embedded Metric Format documents the function writes, so no metric filter is needed
         log_group = logs.LogGroup(
             self, "LoggingFunctionLogGroup",
             log_group_name=f"/aws/lambda/{logging_function.function_name}",
             retention=logs.RetentionDays.ONE_WEEK
         )
 
-        # Add a Metric Filter to monitor size_delta values in logs
-        metric_filter = logs.MetricFilter(
-            self, "SizeDeltaMetric",
-            log_group=log_group,
-            metric_namespace="BucketMetrics",
-            metric_name="ObjectSizeChanges",
-            filter_pattern=logs.FilterPattern.exists("$.size_delta"),  # Check if size_delta exists
-            metric_value="$.size_delta"
+        # Define a DynamoDB table of per-bucket cleanup leases, so concurrent cleanup runs are serialized
+        lease_table = Table(
+            self, "CleanupLeaseTable",
+            partition_key=Attribute(name="LeaseId", type=AttributeType.STRING),
+            billing_mode=BillingMode.PAY_PER_REQUEST
         )
 
         # Create a Lambda function for cleaning up bucket data
@@ -61,13 +141,33 @@ class LogHandlerStack(Stack):
             runtime=lambda_.Runtime.PYTHON_3_8,
             handler="cleaner.lambda_handler",
             code=lambda_.Code.from_asset("lambda"),
-            timeout=Duration.seconds(60),
+            timeout=Duration.minutes(5),
             environment={
-                'BUCKET_NAME': bucket.bucket_name
+                'BUCKET_NAME': buckets[0].bucket_name,
+                'WATCHED_BUCKETS': watched_bucket_names,
+                'CLEANUP_TOP_K': '10',
+                'CLEANUP_MODE': 'largest',
+                'CLEANUP_POLICY': 'largest',
+                'CLEANUP_MAX_DELETES': '10000',
+                'LEASE_TABLE_NAME': lease_table.table_name,
+                'LEASE_SECONDS': '300',
+                'CLEANUP_ALARM_LOOKBACK_SECONDS': '60',
+                'OBJECT_INDEX_TABLE_NAME': index_table.table_name,
+                'AGGREGATE_TABLE_NAME': aggregate_table.table_name,
+                'LIST_WORKERS': '16',
+                'LIST_SPLIT_DEPTH': '1'
             }
         )
-        bucket.grant_read_write(cleanup_function)
-        bucket.grant_delete(cleanup_function)
+        for bucket in buckets:
+            bucket.grant_read_write(cleanup_function)
+            bucket.grant_delete(cleanup_function)
+        index_table.grant_read_data(cleanup_function)
+        aggregate_table.grant_read_data(cleanup_function)
+        lease_table.grant_read_write_data(cleanup_function)
+
+        # Let the logging Lambda invoke the cleanup directly when its sliding window crosses the threshold
+        logging_function.add_environment('CLEANER_FUNCTION_NAME', cleanup_function.function_name)
+        cleanup_function.grant_invoke(logging_function)
 
         # Create an SNS topic for triggering the Cleanup Lambda
         cleanup_alarm_topic = Topic(self, "CleanupAlarmTopic")
@@ -75,21 +175,28 @@ class LogHandlerStack(Stack):
         # Subscribe the Cleanup Lambda to the alarm topic
         cleanup_alarm_topic.add_subscription(LambdaSubscription(cleanup_function))
 
-        # Define a CloudWatch alarm based on the ObjectSizeChanges metric
-        size_alarm = cloudwatch.Alarm(
-            self, "ObjectSizeAlarm",
-            metric=cloudwatch.Metric(
-                namespace="BucketMetrics",
-                metric_name="ObjectSizeChanges",
-                statistic="Sum",
-                period=Duration.seconds(10),
-            ),
-            threshold=15,
-            evaluation_periods=1,
-            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
-        )
+        # Define a CloudWatch alarm per bucket on its ObjectSizeChanges metric, kept as a fallback for the
+        # threshold the logging Lambda evaluates itself; the alarm's dimensions tell the cleaner which
+        # bucket crossed it
+        for index, bucket in enumerate(buckets):
+            size_alarm = cloudwatch.Alarm(
+                self, f"ObjectSizeAlarm{index}",
+                metric=cloudwatch.Metric(
+                    namespace="BucketMetrics",
+                    metric_name="ObjectSizeChanges",
+                    dimensions_map={"BucketName": bucket.bucket_name},
+                    statistic="Sum",
+                    period=Duration.seconds(10),
+                ),
+                threshold=size_threshold,
+                evaluation_periods=1,
+                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
+            )
 
-        # Trigger the Cleanup Lambda when the alarm is raised
-        size_alarm.add_alarm_action(
-            cloudwatch_actions.SnsAction(cleanup_alarm_topic)
-        )
+            # Trigger the Cleanup Lambda when the alarm is raised
+            size_alarm.add_alarm_action(
+                cloudwatch_actions.SnsAction(cleanup_alarm_topic)
+            )
+
+        # Expose the event archive for consumers that replay it
+        self.archive_bucket = archive_bucket
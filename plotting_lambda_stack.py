@@ -1,11 +1,12 @@
+from typing import Sequence
 from aws_cdk import Stack, Duration
 from aws_cdk.aws_lambda import Function, Runtime, Code, Architecture, LayerVersion
 from aws_cdk.aws_dynamodb import Table
-from aws_cdk.aws_s3 import Bucket
+from aws_cdk.aws_s3 import Bucket, IBucket
 from constructs import Construct
 
 class PlotFunctionStack(Stack):
-    def __init__(self, scope: Construct, stack_id: str, table: Table, bucket: Bucket, **kwargs):
+    def __init__(self, scope: Construct, stack_id: str, table: Table, buckets: Sequence[IBucket], aggregate_table: Table, prefix_table: Table, archive_bucket: IBucket, **kwargs):
         super().__init__(scope, stack_id, **kwargs)
 
         # Define the ARN for the Matplotlib layer
@@ -26,11 +27,18 @@ class PlotFunctionStack(Stack):
             layers=[matplotlib_layer],
             environment={
                 'DYNAMODB_TABLE_NAME': table.table_name,
+                'AGGREGATE_TABLE_NAME': aggregate_table.table_name,
+                'PREFIX_TABLE_NAME': prefix_table.table_name,
                 'PLOT_BUCKET_NAME': plot_storage_bucket.bucket_name,
-                'BUCKET_NAME': bucket.bucket_name
+                'BUCKET_NAME': buckets[0].bucket_name,
+                'WATCHED_BUCKETS': self.to_json_string([bucket.bucket_name for bucket in buckets]),
+                'EVENT_ARCHIVE_BUCKET': archive_bucket.bucket_name
             }
         )
 
         # Grant necessary permissions to the Lambda function
         plot_storage_bucket.grant_read_write(plotting_function)
         table.grant_read_write_data(plotting_function)
+        aggregate_table.grant_read_data(plotting_function)
+        prefix_table.grant_read_data(plotting_function)
+        archive_bucket.grant_read(plotting_function)
@@ -1,15 +1,19 @@
+from typing import Sequence
 from aws_cdk import Stack, Duration
-from aws_cdk.aws_dynamodb import Table, Attribute, AttributeType, BillingMode
+from aws_cdk.aws_dynamodb import Table, Attribute, AttributeType, BillingMode, ProjectionType
 from aws_cdk.aws_lambda import Function, Runtime, Code
 from aws_cdk.aws_lambda_event_sources import SqsEventSource
+from aws_cdk.aws_events import Rule, Schedule
+from aws_cdk.aws_events_targets import LambdaFunction
+from aws_cdk.aws_iam import PolicyStatement
 from constructs import Construct
-from aws_cdk.aws_sqs import Queue
+from aws_cdk.aws_sqs import Queue, DeadLetterQueue
 from aws_cdk.aws_sns import Topic
 from aws_cdk.aws_sns_subscriptions import SqsSubscription
-from aws_cdk.aws_s3 import Bucket
+from aws_cdk.aws_s3 import IBucket
 
 class BucketSizeTrackerStack(Stack):
-    def __init__(self, scope: Construct, stack_id: str, topic: Topic, bucket: Bucket, **kwargs):
+    def __init__(self, scope: Construct, stack_id: str, topic: Topic, buckets: Sequence[IBucket], **kwargs):
         super().__init__(scope, stack_id, **kwargs)
 
         # Define a DynamoDB table for tracking bucket metrics
@@ -20,9 +24,68 @@ class BucketSizeTrackerStack(Stack):
             billing_mode=BillingMode.PAY_PER_REQUEST
         )
 
+        # Define a DynamoDB table holding one running-total item per bucket, plus short-lived
+        # sliding-window items that expire through the table's TTL
+        aggregate_table = Table(
+            self, "BucketTotalsTable",
+            partition_key=Attribute(name="BucketName", type=AttributeType.STRING),
+            billing_mode=BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="ExpiresAt"
+        )
+
+        # Define a DynamoDB table indexing every object's last known size, ETag and sequencer;
+        # removed objects leave a tombstone that expires through the table's TTL
+        index_table = Table(
+            self, "ObjectIndexTable",
+            partition_key=Attribute(name="BucketName", type=AttributeType.STRING),
+            sort_key=Attribute(name="Key", type=AttributeType.STRING),
+            billing_mode=BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="ExpiresAt"
+        )
+        # Sparse index over the size tracker's live entries, so the cleaner finds the largest objects
+        # with a descending Query instead of listing the bucket
+        index_table.add_global_secondary_index(
+            index_name="BySize",
+            partition_key=Attribute(name="SizeClass", type=AttributeType.STRING),
+            sort_key=Attribute(name="Size", type=AttributeType.NUMBER),
+            projection_type=ProjectionType.INCLUDE,
+            non_key_attributes=["EventTime"]
+        )
+
+        # Define a DynamoDB table with the aggregated size of every prefix, stored under its parent
+        # prefix and indexed by size so the largest children of a prefix come back from one Query
+        prefix_table = Table(
+            self, "PrefixSizeTable",
+            partition_key=Attribute(name="ParentPrefix", type=AttributeType.STRING),
+            sort_key=Attribute(name="Prefix", type=AttributeType.STRING),
+            billing_mode=BillingMode.PAY_PER_REQUEST
+        )
+        prefix_table.add_local_secondary_index(
+            index_name="BySize",
+            sort_key=Attribute(name="TotalSize", type=AttributeType.NUMBER)
+        )
+
+        # Define a DynamoDB table recording which consumer has processed which S3 event, so redelivered
+        # events are dropped; records expire once SQS can no longer redeliver them
+        idempotency_table = Table(
+            self, "ProcessedEventsTable",
+            partition_key=Attribute(name="EventId", type=AttributeType.STRING),
+            billing_mode=BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="ExpiresAt"
+        )
+
         # Create an SQS queue and subscribe it to the SNS topic
-        event_queue = Queue(self, "BucketEventQueue", visibility_timeout=Duration.seconds(300))
-        topic.add_subscription(SqsSubscription(event_queue))
+        # Messages that keep failing are moved to a dead-letter queue instead of being retried forever
+        event_queue = Queue(
+            self, "BucketEventQueue",
+            visibility_timeout=Duration.seconds(300),
+            dead_letter_queue=DeadLetterQueue(
+                max_receive_count=5,
+                queue=Queue(self, "BucketEventDeadLetterQueue", retention_period=Duration.days(14))
+            )
+        )
+        # Raw delivery puts the S3 notification itself in the message body, saving a JSON decode per message
+        topic.add_subscription(SqsSubscription(event_queue, raw_message_delivery=True))
 
         # Create the Lambda function for size tracking
         tracking_function = Function(
@@ -33,15 +96,78 @@ class BucketSizeTrackerStack(Stack):
             code=Code.from_asset("lambda"),
             environment={
                 'DYNAMODB_TABLE_NAME': tracking_table.table_name,
-                'BUCKET_NAME': bucket.bucket_name
+                'AGGREGATE_TABLE_NAME': aggregate_table.table_name,
+                'OBJECT_INDEX_TABLE_NAME': index_table.table_name,
+                'PREFIX_TABLE_NAME': prefix_table.table_name,
+                'IDEMPOTENCY_TABLE_NAME': idempotency_table.table_name,
+                'IDEMPOTENCY_IN_PROGRESS_SECONDS': '300',
+                'PREFIX_DEPTH': '3',
+                'BUCKET_NAME': buckets[0].bucket_name,
+                'WATCHED_BUCKETS': self.to_json_string([bucket.bucket_name for bucket in buckets]),
+                'SIZE_TRACKING_MODE': 'incremental',
+                'LIST_WORKERS': '16',
+                'LIST_SPLIT_DEPTH': '1'
             }
         )
 
-        # Add the SQS queue as an event source for the Lambda function
-        tracking_function.add_event_source(SqsEventSource(event_queue))
+        # Add the SQS queue as an event source, batching bursts so each bucket is recomputed once per batch
+        tracking_function.add_event_source(SqsEventSource(
+            event_queue,
+            batch_size=100,
+            max_batching_window=Duration.seconds(5),
+            report_batch_item_failures=True
+        ))
 
         # Grant permissions for the Lambda function to interact with resources
         tracking_table.grant_read_write_data(tracking_function)  # DynamoDB access
+        aggregate_table.grant_read_write_data(tracking_function)  # DynamoDB access
+        index_table.grant_read_write_data(tracking_function)  # DynamoDB access
+        prefix_table.grant_read_write_data(tracking_function)  # DynamoDB access
+        idempotency_table.grant_read_write_data(tracking_function)  # DynamoDB access
         topic.grant_publish(tracking_function)  # SNS access
-        bucket.grant_read(tracking_function)  # S3 read access
+        for bucket in buckets:
+            bucket.grant_read(tracking_function)  # S3 read access
         event_queue.grant_consume_messages(tracking_function)  # SQS access
+
+        # Create the Lambda function that reconciles running totals with the real bucket contents
+        reconcile_function = Function(
+            self, "SizeReconcileFunction",
+            runtime=Runtime.PYTHON_3_8,
+            handler="reconcile.lambda_handler",
+            timeout=Duration.minutes(15),
+            code=Code.from_asset("lambda"),
+            environment={
+                'DYNAMODB_TABLE_NAME': tracking_table.table_name,
+                'AGGREGATE_TABLE_NAME': aggregate_table.table_name,
+                'BUCKET_NAME': buckets[0].bucket_name,
+                'WATCHED_BUCKETS': self.to_json_string([bucket.bucket_name for bucket in buckets]),
+                'RECONCILE_MIN_INTERVAL': '900',
+                'RECONCILE_MAX_INTERVAL': '86400',
+                'LIST_WORKERS': '16',
+                'LIST_SPLIT_DEPTH': '1'
+            }
+        )
+
+        # Check every bucket on a fixed schedule; the function decides which buckets are due
+        Rule(
+            self, "SizeReconcileSchedule",
+            schedule=Schedule.rate(Duration.minutes(15)),
+            targets=[LambdaFunction(reconcile_function)]
+        )
+
+        # Grant permissions for the reconciliation function
+        tracking_table.grant_read_write_data(reconcile_function)  # DynamoDB access
+        aggregate_table.grant_read_write_data(reconcile_function)  # DynamoDB access
+        for bucket in buckets:
+            bucket.grant_read(reconcile_function)  # S3 read access
+        reconcile_function.add_to_role_policy(PolicyStatement(
+            actions=["cloudwatch:PutMetricData"],
+            resources=["*"]
+        ))
+
+        # Expose the tables to the stacks that read them
+        self.table = tracking_table
+        self.aggregate_table = aggregate_table
+        self.index_table = index_table
+        self.prefix_table = prefix_table
+        self.idempotency_table = idempotency_table
@@ -1,3 +1,4 @@
+from typing import Sequence
 from aws_cdk import Stack, Duration
 from aws_cdk.aws_s3 import Bucket, EventType
 from aws_cdk.aws_s3_notifications import SnsDestination
@@ -5,19 +6,26 @@ from aws_cdk.aws_sns import Topic
 from constructs import Construct
 
 class NotificationEnabledStorageStack(Stack):
-    def __init__(self, scope: Construct, stack_id: str, **kwargs):
+    def __init__(self, scope: Construct, stack_id: str, bucket_ids: Sequence[str] = ("NotificationBucket",),
+                 existing_bucket_names: Sequence[str] = (), **kwargs):
         super().__init__(scope, stack_id, **kwargs)
 
-        # Create an S3 bucket for storage
-        storage_bucket = Bucket(self, "NotificationBucket")
+        # Create the S3 buckets for storage and import existing buckets that should be watched as well
+        storage_buckets = [Bucket(self, bucket_id) for bucket_id in bucket_ids]
+        storage_buckets += [
+            Bucket.from_bucket_name(self, f"WatchedBucket-{bucket_name}", bucket_name)
+            for bucket_name in existing_bucket_names
+        ]
 
         # Create an SNS topic for bucket events
         bucket_event_topic = Topic(self, "S3BucketEventTopic")
 
-        # Configure the S3 bucket to send notifications for object events to the SNS topic
-        storage_bucket.add_event_notification(EventType.OBJECT_CREATED, SnsDestination(bucket_event_topic))
-        storage_bucket.add_event_notification(EventType.OBJECT_REMOVED, SnsDestination(bucket_event_topic))
+        # Configure every bucket to send notifications for object events to the same SNS topic
+        for storage_bucket in storage_buckets:
+            storage_bucket.add_event_notification(EventType.OBJECT_CREATED, SnsDestination(bucket_event_topic))
+            storage_bucket.add_event_notification(EventType.OBJECT_REMOVED, SnsDestination(bucket_event_topic))
 
-        # Expose the bucket and topic as attributes
-        self.bucket = storage_bucket
+        # Expose the buckets and topic as attributes; the first bucket is the default one
+        self.buckets = storage_buckets
+        self.bucket = storage_buckets[0]
         self.topic = bucket_event_topic
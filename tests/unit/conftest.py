@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The Lambda modules live in lambda/, which is not an importable package name; it goes last on the
+# path so its logging.py does not shadow the standard library module
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(ROOT, 'lambda'))
+
+# The modules create their AWS clients at import time, which needs a region but no credentials
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+import inventory
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# A local copy of the destination bucket, laid out the way S3 Inventory writes it
+FIXTURE_ROOT = os.path.join(ROOT, 'tests', 'fixtures', 'inventory')
+MANIFEST = os.path.join(FIXTURE_ROOT, 'inventory', 'source-bucket', 'daily', '2026-01-01T01-00Z', 'manifest.json')
+
+
+def test_data_files_resolve_against_destination_bucket_root():
+    manifest = inventory.read_manifest(MANIFEST)
+    assert inventory.data_file_locations(MANIFEST, manifest) == [
+        os.path.join(FIXTURE_ROOT, 'inventory', 'source-bucket', 'daily', 'data', 'part-0.csv.gz'),
+        os.path.join(FIXTURE_ROOT, 'inventory', 'source-bucket', 'daily', 'data', 'part-1.csv.gz')
+    ]
+    assert inventory.data_file_locations('s3://inventory-destination/manifest.json', manifest) == [
+        's3://inventory-destination/inventory/source-bucket/daily/data/part-0.csv.gz',
+        's3://inventory-destination/inventory/source-bucket/daily/data/part-1.csv.gz'
+    ]
+
+
+def test_records_skip_noncurrent_versions_and_delete_markers():
+    assert list(inventory.iter_inventory_records(MANIFEST)) == [
+        ('logs/app 1.log', 100),
+        ('data/2026/a.bin', 1000),
+        ('root.txt', 5)
+    ]
+
+
+def test_summary_totals_and_prefix_sizes():
+    summary = inventory.summarize_inventory(MANIFEST, prefix_depth=2, data_root=FIXTURE_ROOT)
+    assert summary['bucket'] == 'source-bucket'
+    assert summary['created'] == 1767229200000
+    assert summary['total_size'] == 1105
+    assert summary['object_count'] == 3
+    assert summary['prefix_sizes'] == {
+        'logs/': {'size': 100, 'count': 1},
+        'data/2026/': {'size': 1000, 'count': 1},
+        '': {'size': 5, 'count': 1}
+    }
+
+
+def test_only_csv_inventories_are_read(tmp_path):
+    manifest = tmp_path / 'manifest.json'
+    manifest.write_text('{"fileFormat": "Parquet", "files": []}')
+    with pytest.raises(ValueError):
+        inventory.read_manifest(str(manifest))
@@ -0,0 +1,54 @@
+import importlib.util
+import json
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# lambda/logging.py shares its name with the standard library module, so it is loaded from its path
+spec = importlib.util.spec_from_file_location('logging_lambda', os.path.join(ROOT, 'lambda', 'logging.py'))
+logging_lambda = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(logging_lambda)
+
+
+def emitted_documents(capsys, summaries):
+    for document in logging_lambda.summary_documents(summaries):
+        logging_lambda.emit(document)
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_summary_is_emitted_as_one_emf_line_per_prefix(capsys):
+    summaries = {}
+    for key, size_change in (('logs/a.log', 20), ('logs/b.log', -5), ('logs/c.log', 7), ('root.txt', 3)):
+        logging_lambda.add_to_summary(summaries, logging_lambda.summary_key('bucket-a', key), size_change)
+
+    logs_document, root_document = emitted_documents(capsys, summaries)
+
+    directive = logs_document['_aws']['CloudWatchMetrics']
+    assert isinstance(logs_document['_aws']['Timestamp'], int)
+    assert directive == [{
+        'Namespace': 'BucketMetrics',
+        'Dimensions': [[], ['BucketName'], ['BucketName', 'Prefix']],
+        'Metrics': [{'Name': 'ObjectSizeChanges', 'Unit': 'Bytes', 'StorageResolution': 1}]
+    }]
+    assert logs_document['BucketName'] == 'bucket-a'
+    assert logs_document['Prefix'] == 'logs/'
+    assert logs_document['ObjectSizeChanges'] == 22
+    assert logs_document['EventCount'] == 3
+    assert logs_document['MinSizeChange'] == -5
+    assert logs_document['MaxSizeChange'] == 20
+
+    assert root_document['Prefix'] == '/'
+    assert root_document['ObjectSizeChanges'] == 3
+    assert root_document['EventCount'] == 1
+
+
+def test_every_dimension_is_a_member_of_the_document(capsys):
+    summaries = {}
+    logging_lambda.add_to_summary(summaries, logging_lambda.summary_key('bucket-a', 'data/x.bin'), 10)
+
+    document, = emitted_documents(capsys, summaries)
+    for dimension_set in document['_aws']['CloudWatchMetrics'][0]['Dimensions']:
+        for dimension in dimension_set:
+            assert isinstance(document[dimension], str)
+    for metric in document['_aws']['CloudWatchMetrics'][0]['Metrics']:
+        assert isinstance(document[metric['Name']], (int, float))
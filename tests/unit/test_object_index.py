@@ -0,0 +1,72 @@
+import object_index
+from object_index import apply_key_events, normalize_sequencer
+from s3_events import ObjectEvent
+
+PARTITION = 'bucket-a'
+NOW = 1767225600
+
+
+def object_event(event_name, sequencer, size=None, key='data/a.bin'):
+    return ObjectEvent('m1', PARTITION, key, size, event_name, sequencer, '2026-01-01T00:00:00.000Z', 'etag')
+
+
+def indexed(size, sequencer):
+    return {'BucketName': PARTITION, 'Key': 'data/a.bin', 'Size': size, 'Sequencer': normalize_sequencer(sequencer)}
+
+
+def test_removal_applied_before_a_later_create(monkeypatch):
+    # The create arrives first but carries the higher sequencer, so the removal is applied first
+    # and the key ends up live with the created size
+    events = [object_event('ObjectCreated:Put', '0B', 40), object_event('ObjectRemoved:Delete', '0A')]
+    writes = []
+    monkeypatch.setattr(object_index, 'load_index_entries', lambda partition, keys: {'data/a.bin': indexed(25, '05')})
+    monkeypatch.setattr(object_index, 'write_entries', lambda batch, written_keys: writes.extend(batch))
+
+    assert object_index.resolve_deltas(PARTITION, events, 'logging') == [(40, 1), (-25, -1)]
+    entry, = [write['Put']['Item'] for write in writes]
+    assert entry['Size'] == 40
+    assert entry['Sequencer'] == normalize_sequencer('0B')
+    assert not entry.get('Deleted')
+
+
+def test_duplicate_sequencer_changes_nothing():
+    entry = indexed(25, '0A')
+    new_entry, deltas = apply_key_events(PARTITION, entry, [(0, object_event('ObjectCreated:Put', '0A', 25))], NOW, True)
+    assert deltas == {0: (0, 0)}
+    assert new_entry is entry
+
+
+def test_older_event_than_the_entry_changes_nothing():
+    entry = indexed(25, '0B')
+    new_entry, deltas = apply_key_events(PARTITION, entry, [(0, object_event('ObjectRemoved:Delete', '0A'))], NOW, True)
+    assert deltas == {0: (0, 0)}
+    assert new_entry is entry
+
+
+def test_overwrite_adds_only_the_difference():
+    new_entry, deltas = apply_key_events(
+        PARTITION, indexed(25, '0A'), [(0, object_event('ObjectCreated:Put', '0B', 60))], NOW, True
+    )
+    assert deltas == {0: (35, 0)}
+    assert new_entry['Size'] == 60
+    assert new_entry['Sequencer'] == normalize_sequencer('0B')
+    assert new_entry['SizeClass'] == f"{PARTITION}#02"
+
+
+def test_create_of_an_unindexed_key_counts_the_object():
+    new_entry, deltas = apply_key_events(PARTITION, None, [(0, object_event('ObjectCreated:Put', '0A', 7))], NOW, False)
+    assert deltas == {0: (7, 1)}
+    assert 'SizeClass' not in new_entry
+
+
+def test_removal_of_an_unindexed_key_cannot_be_resolved():
+    new_entry, deltas = apply_key_events(PARTITION, None, [(0, object_event('ObjectRemoved:Delete', '0A'))], NOW, True)
+    assert deltas == {0: None}
+    assert new_entry['Deleted']
+    assert new_entry['ExpiresAt'] == NOW + object_index.TOMBSTONE_TTL
+
+
+def test_removal_of_a_removed_key_changes_nothing():
+    removed = object_index.tombstone(PARTITION, 'data/a.bin', normalize_sequencer('0A'), NOW)
+    _, deltas = apply_key_events(PARTITION, removed, [(0, object_event('ObjectRemoved:Delete', '0B'))], NOW, True)
+    assert deltas == {0: (0, 0)}
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from s3_events import ObjectEvent, iter_object_events
+
+S3_RECORD = {
+    'eventName': 'ObjectCreated:Put',
+    'eventTime': '2026-01-01T00:00:00.123Z',
+    's3': {
+        'bucket': {'name': 'bucket-a'},
+        'object': {'key': 'logs/app+1%2B.log', 'size': 42, 'eTag': 'abc', 'sequencer': '0A'}
+    }
+}
+NOTIFICATION = {'Records': [S3_RECORD]}
+
+
+def expected(message_id):
+    return ObjectEvent(message_id, 'bucket-a', 'logs/app 1+.log', 42, 'ObjectCreated:Put', '0A',
+                       '2026-01-01T00:00:00.123Z', 'abc')
+
+
+def sns_envelope(message):
+    return {'Type': 'Notification', 'MessageId': 'sns-1', 'Message': json.dumps(message)}
+
+
+def test_sns_envelope_in_sqs_body():
+    event = {'Records': [{'messageId': 'm1', 'body': json.dumps(sns_envelope(NOTIFICATION))}]}
+    assert list(iter_object_events(event)) == [expected('m1')]
+
+
+def test_raw_notification_in_sqs_body():
+    event = {'Records': [{'messageId': 'm1', 'body': json.dumps(NOTIFICATION)}]}
+    assert list(iter_object_events(event)) == [expected('m1')]
+
+
+def test_direct_sns_invocation():
+    event = {'Records': [{'Sns': {'MessageId': 'sns-1', 'Message': json.dumps(NOTIFICATION)}}]}
+    assert list(iter_object_events(event)) == [expected('sns-1')]
+
+
+def test_direct_s3_invocation():
+    assert list(iter_object_events({'Records': [S3_RECORD]})) == [expected(None)]
+
+
+def test_eventbridge_event():
+    event = {
+        'id': 'eb-1',
+        'detail-type': 'Object Deleted',
+        'time': '2026-01-01T00:00:01Z',
+        'detail': {
+            'bucket': {'name': 'bucket-a'},
+            'object': {'key': 'logs/app.log', 'sequencer': '0B'},
+            'reason': 'DeleteObject'
+        }
+    }
+    assert list(iter_object_events(event)) == [
+        ObjectEvent('eb-1', 'bucket-a', 'logs/app.log', None, 'ObjectRemoved:DeleteObject', '0B', '2026-01-01T00:00:01Z', '')
+    ]
+
+
+def test_test_events_carry_no_records():
+    event = {'Records': [{'messageId': 'm1', 'body': json.dumps({'Event': 's3:TestEvent'})}]}
+    failed_message_ids = set()
+    assert list(iter_object_events(event, failed_message_ids)) == []
+    assert failed_message_ids == set()
+
+
+def test_malformed_messages_are_reported_and_skipped():
+    event = {'Records': [
+        {'messageId': 'not-json', 'body': '{'},
+        {'messageId': 'not-an-object', 'body': '[1, 2]'},
+        {'messageId': 'no-s3', 'body': json.dumps({'Records': [{'eventName': 'ObjectCreated:Put'}]})},
+        {'Sns': {'MessageId': 'bad-sns', 'Message': 'nope'}},
+        {'messageId': 'm1', 'body': json.dumps(NOTIFICATION)}
+    ]}
+    failed_message_ids = set()
+    assert list(iter_object_events(event, failed_message_ids)) == [expected('m1')]
+    assert failed_message_ids == {'not-json', 'not-an-object', 'no-s3', 'bad-sns'}
+
+
+def test_malformed_message_raises_without_a_failure_set():
+    with pytest.raises(ValueError):
+        list(iter_object_events({'Records': [{'messageId': 'm1', 'body': '{'}]}))